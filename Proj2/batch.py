@@ -0,0 +1,123 @@
+'''
+Batch evaluation of many scenarios against one goal tree.
+
+A scenario is what the PrairieLearn globals of assignment4.py are for a single
+run: {'norm', 'beliefs', 'goal', 'preferences', 'action_to_explain'}. The tree
+is compiled once, every distinct norm is annotated once (violation_matrix), and
+before any trace is built blocked_matrix() marks, for all scenarios at once,
+the nodes that cannot give a trace: violations plus ACT nodes whose
+preconditions can never hold (not believed and not produced by any post).
+Scenarios with a blocked root are answered without searching at all.
+'''
+
+import numpy as np
+
+from beliefs import belief_index
+from goal_tree import ACT, SEQ, AND, OR, as_compiled
+from norms import violation_matrix
+from pipeline import generate_explanation, propagate, top_k_traces
+import profiling
+from tree_index import tree_index
+
+
+def _norm_key(norm):
+    return norm.get("type"), tuple(norm.get("actions", []))
+
+
+def _goal_key(goal):
+    return frozenset(goal) if isinstance(goal, (set, frozenset)) else goal
+
+
+@profiling.timed("blocked_matrix")
+def blocked_matrix(tree, violation, beliefs, goals, goal_check="beliefs"):
+    """
+    Bool matrix (scenarios, nodes): True where execution_trace can return no trace.
+    violation has one annotation row per scenario, beliefs and goals one entry each.
+    The belief check only uses the starting beliefs, so it is conservative: a
+    node that is not blocked can still fail once the search gets there.
+    """
+    tree = as_compiled(tree)
+    index = belief_index(tree)
+    pre_bits, post_bits = index.matrix("pre"), index.matrix("post")
+    n_scenarios = len(beliefs)
+
+    believed = np.zeros((n_scenarios, len(index.bit_of)), dtype=bool)
+    for row, scenario_beliefs in enumerate(beliefs):
+        bits = [index.bit_of[b] for b in scenario_beliefs if b in index.bit_of]
+        believed[row, bits] = True
+    # beliefs only grow, by the posts of executed actions
+    reachable = believed | post_bits.any(axis=0)
+
+    act = tree.types == ACT
+    checked = np.flatnonzero(act & pre_bits.any(axis=1))
+    unmet = pre_bits[checked].astype(np.float32) @ (~reachable).T.astype(np.float32)
+    blocked = np.zeros((n_scenarios, len(tree)), dtype=bool)
+    blocked[:, checked] = (unmet > 0).T
+
+    # an ACT node that reaches the goal skips its preconditions
+    post_present = tree.present["post"]
+    for row, goal in enumerate(goals):
+        if goal_check == "post":
+            bit = index.bit_of.get(goal)
+            if bit is not None:
+                blocked[row, post_bits[:, bit]] = False
+        elif isinstance(goal, (set, frozenset)):
+            blocked[row, act & post_present] = False
+
+    # unknown node types never give a trace
+    blocked[:, ~np.isin(tree.types, (ACT, SEQ, AND, OR))] = True
+    blocked |= violation
+    return propagate(tree, blocked)
+
+
+@profiling.timed("evaluate_batch")
+def evaluate_batch(json_tree, scenarios, goal_check="beliefs", chunk_size=256):
+    """
+    Run the assignment4 pipeline for every scenario, sharing the compiled tree.
+    Returns [(selected_trace, output)] in scenario order, as run_pipeline would,
+    except that an action_to_explain outside the selected trace gives an empty
+    output instead of an exception.
+    """
+    tree = as_compiled(json_tree)
+    norm_rows, norms = {}, []
+    for scenario in scenarios:
+        key = _norm_key(scenario["norm"])
+        if key not in norm_rows:
+            norm_rows[key] = len(norms)
+            norms.append(scenario["norm"])
+    violations = violation_matrix(tree, norms)
+    annotated = [tree.with_violation(v) for v in violations]
+    index = tree_index(tree)
+
+    results = []
+    ranked_cache = {}  # scenarios that only differ in action_to_explain share their traces
+    for start in range(0, len(scenarios), chunk_size):
+        chunk = scenarios[start:start + chunk_size]
+        rows = [norm_rows[_norm_key(s["norm"])] for s in chunk]
+        blocked = blocked_matrix(tree, violations[rows], [s["beliefs"] for s in chunk],
+                                 [s["goal"] for s in chunk], goal_check)
+        for n, scenario in enumerate(chunk):
+            if blocked[n, 0]:
+                results.append(([], []))
+                continue
+            key = (rows[n], frozenset(scenario["beliefs"]), _goal_key(scenario["goal"]),
+                   tuple(scenario["preferences"][1]))
+            ranked = ranked_cache.get(key)
+            if ranked is None:
+                ranked = ranked_cache[key] = top_k_traces(
+                    annotated[rows[n]], scenario["beliefs"], scenario["goal"],
+                    scenario["preferences"], k=2, goal_check=goal_check, blocked=blocked[n])
+            if not len(ranked):
+                results.append(([], []))
+                continue
+            selected, nonselected = ranked.selection()
+            if scenario["action_to_explain"] not in selected[0][0]:
+                # assignment4 raises ValueError here, the other scenarios still get their results
+                results.append((selected[0][0], []))
+                continue
+            output = generate_explanation(annotated[rows[n]], selected, scenario["action_to_explain"],
+                                          scenario["norm"], scenario["preferences"],
+                                          alt_trace=nonselected if nonselected else None,
+                                          index=index)
+            results.append((selected[0][0], output))
+    return results
@@ -0,0 +1,62 @@
+'''
+Checks of batch.evaluate_batch and parallel.explain_parallel, run with the
+configured unittest discovery:
+
+    python -m unittest discover -s Proj2 -p "*test.py"
+'''
+
+import unittest
+
+from batch import evaluate_batch
+from parallel import explain_parallel
+from synthetic import synthetic_scenario, synthetic_tree
+
+
+class UnexplainableScenarioTest(unittest.TestCase):
+    """An action_to_explain outside the selected trace only empties that scenario's output."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data, props = synthetic_tree(depth=5, seed=1)
+        scenarios = [synthetic_scenario(cls.data, props, seed=s, belief_ratio=0.9) for s in range(40)]
+        acts, stack = [], [cls.data]
+        while stack:
+            node = stack.pop()
+            if node["type"] == "ACT":
+                acts.append(node["name"])
+            stack.extend(node.get("children", []))
+
+        # explain an action of each selected trace, then break one scenario in the middle
+        selected = [trace for trace, _ in explain_parallel(cls.data, scenarios, workers=1, seed=0)]
+        cls.explainable = [dict(s, action_to_explain=trace[0]) if trace else s
+                           for s, trace in zip(scenarios, selected)]
+        cls.broken = [k for k, trace in enumerate(selected) if trace][len(scenarios) // 4]
+        cls.scenarios = list(cls.explainable)
+        outside = sorted(set(acts) - set(selected[cls.broken]))
+        cls.scenarios[cls.broken] = dict(cls.scenarios[cls.broken], action_to_explain=outside[0])
+
+    def check(self, explain):
+        expected = explain(self.explainable)
+        results = explain(self.scenarios)
+        self.assertEqual(len(results), len(self.scenarios))
+        self.assertTrue(expected[self.broken][1])
+        self.assertEqual(results[self.broken], (expected[self.broken][0], []))
+        for k, (result, reference) in enumerate(zip(results, expected)):
+            if k != self.broken:
+                self.assertEqual(result, reference, "scenario %d" % k)
+
+    def test_in_process(self):
+        # a chunk size that puts the broken scenario inside a chunk
+        self.check(lambda scenarios: explain_parallel(self.data, scenarios, workers=1, chunk_size=16, seed=0))
+
+    def test_explain_parallel(self):
+        self.check(lambda scenarios: explain_parallel(self.data, scenarios, workers=2, chunk_size=8, seed=0))
+
+    def test_single_scenario(self):
+        trace, output = evaluate_batch(self.data, [self.scenarios[self.broken]])[0]
+        self.assertTrue(trace)
+        self.assertEqual(output, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
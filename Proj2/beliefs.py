@@ -0,0 +1,92 @@
+'''
+Beliefs as bit masks.
+
+Every proposition used in a pre or post list gets a bit. A belief state is then
+a plain Python int, a node's pre/post lists are precompiled masks, checking
+preconditions is one AND and applying a post is one OR. Ints are immutable, so
+"copying" the beliefs at an OR branch or SEQ step costs nothing.
+'''
+
+import numpy as np
+
+from goal_tree import derived
+
+
+class BeliefIndex:
+    """Bit positions of the pre/post propositions of a tree, and per-node masks."""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.bit_of = {}  # proposition string -> bit position
+        for attr in ("pre", "post"):
+            for sid in dict.fromkeys(tree.lists[attr][1].tolist()):
+                self.bit_of.setdefault(tree.symbols[sid], len(self.bit_of))
+        self.pre_mask = self._masks("pre")
+        self.post_mask = self._masks("post")
+        self._matrices = {}
+        self._relevant = None
+
+    def _masks(self, attr):
+        ptr, ids = self.tree.lists[attr]
+        bits = [1 << self.bit_of[self.tree.symbols[sid]] for sid in ids.tolist()]
+        masks = []
+        for i in range(len(self.tree)):
+            mask = 0
+            for bit in bits[ptr[i]:ptr[i + 1]]:
+                mask |= bit
+            masks.append(mask)
+        return masks
+
+    def matrix(self, attr):
+        """(nodes, bits) bool matrix of the pre or post propositions, for vectorized checks."""
+        if attr not in self._matrices:
+            ptr, ids = self.tree.lists[attr]
+            rows = np.repeat(np.arange(len(self.tree)), np.diff(ptr))
+            cols = [self.bit_of[self.tree.symbols[sid]] for sid in ids.tolist()]
+            bits = np.zeros((len(self.tree), len(self.bit_of)), dtype=bool)
+            bits[rows, cols] = True
+            self._matrices[attr] = bits
+        return self._matrices[attr]
+
+    def relevant_masks(self):
+        """Per node, the bits any precondition in its subtree reads."""
+        if self._relevant is None:
+            tree = self.tree
+            relevant = list(self.pre_mask)
+            # children come after their parent in pre-order
+            for i in range(len(tree) - 1, 0, -1):
+                relevant[tree.parent[i]] |= relevant[i]
+            self._relevant = relevant
+        return self._relevant
+
+    def encode(self, beliefs, unknown=None):
+        """
+        Mask of a belief collection. Propositions the tree never uses get bits past
+        the known ones, numbered through unknown (pass the same dict to encode
+        values that have to be compared with each other).
+        """
+        if unknown is None:
+            unknown = {}
+        mask = 0
+        for b in beliefs:
+            bit = self.bit_of.get(b)
+            if bit is None:
+                bit = unknown.setdefault(b, len(self.bit_of) + len(unknown))
+            mask |= 1 << bit
+        return mask
+
+    def decode(self, mask, unknown=None):
+        """Set of proposition strings in a mask."""
+        names = {bit: p for p, bit in self.bit_of.items()}
+        if unknown:
+            names.update({bit: p for p, bit in unknown.items()})
+        return {names[bit] for bit in range(mask.bit_length()) if mask >> bit & 1}
+
+    def holds(self, mask, proposition):
+        bit = self.bit_of.get(proposition)
+        return bit is not None and bool(mask >> bit & 1)
+
+
+def belief_index(tree):
+    """Bit assignment of the tree's propositions and per-node pre/post masks, built once per tree."""
+    return derived(tree, "belief_index", BeliefIndex)
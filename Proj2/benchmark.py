@@ -0,0 +1,298 @@
+'''
+Benchmarks of the trace/explanation pipeline on synthetic goal trees.
+
+For every size preset a tree is generated with synthetic.py and each stage is
+timed (first run and best of --repeat) and memory-profiled (tracemalloc peak
+of one extra run):
+
+  compile_tree            JSON -> CompiledTree (reference: DictImporter)
+  get_traces              ex1.py (largest subtree with at most TRACE_CAP traces)
+  annotate_tree           ex2_test.py (SEQ/OR rule)
+  build_annotated_tree    assignment4.py (SEQ/AND/OR rule)
+  execution_trace         assignment4.py
+  build_forest            trace_forest.py, all SEQ/AND combinations (no reference)
+  pick_lowest_cost_trace  assignment4.py
+  generate_explanation    assignment4.py
+
+On presets marked check the AnyNode reference functions of the assignment
+scripts run on the same inputs as well; their results are compared with the
+compiled pipeline's and their time is reported next to it.
+
+    python benchmark.py                              # small and medium
+    python benchmark.py --sizes tiny,small,large --repeat 5
+    python benchmark.py --compare old_results.json   # flag slower stages
+
+With --out the results are also written as JSON.
+'''
+
+import argparse
+import ast
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from anytree import PreOrderIter
+from anytree.importer import DictImporter
+import numpy as np
+
+from goal_tree import ACT, SEQ, AND, OR, compile_tree
+import pipeline
+from synthetic import synthetic_scenario, synthetic_tree
+from trace_forest import build_forest
+from tree_index import tree_index
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SIZES = {
+    "tiny": {"tree": {"depth": 3}, "check": True},
+    "small": {"tree": {"depth": 5}, "check": True},
+    "medium": {"tree": {"depth": 6, "fan_out": {"OR": 4, "SEQ": 4, "AND": 3}}, "check": True},
+    "large": {"tree": {"depth": 8, "fan_out": {"OR": 4, "SEQ": 4, "AND": 3}}, "check": False},
+    "huge": {"tree": {"depth": 9, "fan_out": {"OR": 4, "SEQ": 4, "AND": 3}}, "check": False},
+}
+TRACE_CAP = 100000  # ex1's get_traces builds every OR combination at once
+SLOWER = 1.2  # --compare flags stages that got this much slower
+
+
+def load_script_functions(file_name):
+    """
+    Imports and functions of one of the assignment scripts, without running its
+    module-level code (which needs the PrairieLearn globals).
+    """
+    path = os.path.join(HERE, file_name)
+    with open(path, encoding="utf-8") as f:
+        module = ast.parse(f.read(), path)
+    module.body = [stmt for stmt in module.body
+                   if isinstance(stmt, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef))]
+    namespace = {"__name__": os.path.splitext(file_name)[0]}
+    exec(compile(module, path, "exec"), namespace)
+    return namespace
+
+
+def measure(fn, repeat):
+    """(result of the first run, {first/min/median seconds, peak bytes})."""
+    times = []
+    result = None
+    for n in range(max(repeat, 1)):
+        started = time.perf_counter()
+        value = fn()
+        times.append(time.perf_counter() - started)
+        if n == 0:
+            result = value
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {"first": times[0], "min": min(times), "median": statistics.median(times),
+                    "peak_bytes": peak}
+
+
+def _scenario_with_traces(data, props, seed, cost_dims):
+    """
+    A scenario that has execution traces, so every stage runs: in a large tree
+    a random half of the beliefs rarely satisfies a whole SEQ/AND subtree, so
+    more beliefs are tried until one of 25 seeds gives traces.
+    """
+    tree = compile_tree(data)
+    for belief_ratio in (0.5, 0.75, 0.9, 1.0):
+        for scenario_seed in range(seed, seed + 25):
+            scenario = synthetic_scenario(data, props, seed=scenario_seed, cost_dims=cost_dims,
+                                          belief_ratio=belief_ratio)
+            annotated = pipeline.build_annotated_tree(tree, scenario["norm"])
+            if pipeline.execution_trace(annotated, set(scenario["beliefs"]), scenario["goal"]):
+                scenario["seed"], scenario["belief_ratio"] = scenario_seed, belief_ratio
+                return scenario
+    return scenario
+
+
+def _trace_root(tree, cap=TRACE_CAP):
+    """
+    (node id, traces) of the largest subtree with at most cap traces of ex1's
+    get_traces: a product over SEQ/AND children, a sum over OR children.
+    """
+    types = tree.types.tolist()
+    count = [0] * len(tree)
+    for i in range(len(tree) - 1, -1, -1):
+        kids = tree.children(i).tolist()
+        if types[i] == ACT:
+            count[i] = 1
+        elif types[i] in (SEQ, AND):
+            count[i] = 1
+            for child in kids:
+                count[i] *= count[child]
+        elif types[i] == OR:
+            count[i] = sum(count[child] for child in kids)
+    size = (tree.end - np.arange(len(tree))).tolist()
+    node = max((i for i in range(len(tree)) if count[i] <= cap), key=lambda i: (size[i], -i))
+    return node, count[node]
+
+
+def _names(trace_list):
+    return [[node.name for node in trace] for trace in trace_list]
+
+
+def run_size(label, config, repeat, seed, references):
+    """Benchmark one size preset, returns its result dict."""
+    data, props = synthetic_tree(seed=seed, **config["tree"])
+    scenario = _scenario_with_traces(data, props, seed, config["tree"].get("cost_dims", 3))
+    norm, beliefs, goal = scenario["norm"], scenario["beliefs"], scenario["goal"]
+    preferences, action = scenario["preferences"], scenario["action_to_explain"]
+    check = config["check"]
+    ex1, ex2, a4 = references["ex1"], references["ex2_test"], references["assignment4"]
+    stages = {}
+
+    def stage(name, ours, reference=None, same=None):
+        result, stats = measure(ours, repeat)
+        if check and reference is not None:
+            expected, ref_stats = measure(reference, repeat)
+            stats["reference_min"] = ref_stats["min"]
+            stats["reference_peak_bytes"] = ref_stats["peak_bytes"]
+            stats["check"] = same(result, expected) if same else "ok"
+        stages[name] = stats
+        return result
+
+    def equal(result, expected):
+        return "ok" if result == expected else "mismatch"
+
+    tree = stage("compile_tree", lambda: compile_tree(data), lambda: DictImporter().import_(data),
+                 lambda result, expected: equal(result.names, [n.name for n in PreOrderIter(expected)]))
+    anynode = DictImporter().import_(data) if check else None
+
+    # the original enumerates everything, so both sides run unlimited on a subtree it can finish
+    trace_root, trace_count = _trace_root(tree)
+    start_node = list(PreOrderIter(anynode))[trace_root] if check else None
+    stage("get_traces", lambda: pipeline.get_traces(tree, trace_root),
+          lambda: ex1["get_traces"](start_node), equal)
+    stages["get_traces"].update(node=tree.names[trace_root], traces=trace_count)
+
+    def same_violations(result, expected):
+        return equal(result.violation.tolist(), [n.violation for n in PreOrderIter(expected)])
+
+    stage("annotate_tree", lambda: pipeline.build_annotated_tree(tree, norm, any_types=(SEQ,)),
+          lambda: ex2["annotate_tree"](anynode, norm), same_violations)
+    annotated = stage("build_annotated_tree", lambda: pipeline.build_annotated_tree(tree, norm),
+                      lambda: a4["build_annotated_tree"](data, norm), same_violations)
+    root = a4["build_annotated_tree"](data, norm) if check else None
+
+    traces = stage("execution_trace", lambda: pipeline.execution_trace(annotated, set(beliefs), goal),
+                   lambda: a4["execution_trace"](root, set(beliefs), goal),
+                   lambda result, expected: equal([pipeline.trace_names(annotated, t) for t in result],
+                                                  _names(expected)))
+    ref_traces = a4["execution_trace"](root, set(beliefs), goal) if check else None
+    forest = stage("build_forest", lambda: build_forest(annotated, set(beliefs), goal))
+
+    if traces:
+        def seeded(fn):
+            def run():
+                random.seed(seed)
+                return fn()
+            return run
+
+        selected, nonselected = stage(
+            "pick_lowest_cost_trace",
+            seeded(lambda: pipeline.pick_lowest_cost_trace(annotated, traces, preferences)),
+            seeded(lambda: a4["pick_lowest_cost_trace"](ref_traces, preferences)),
+            lambda result, expected: equal(repr(result), repr(expected)))
+        alt_trace = nonselected if nonselected else None
+        index = tree_index(annotated)
+        if action not in selected[0][0]:
+            # the scripts only explain actions of the selected trace
+            acts = [name for name in selected[0][0] if annotated.type_name(annotated.find(name)) == "ACT"]
+            action = scenario["action_to_explain"] = random.Random(seed).choice(acts)
+
+        def reference_explanation():
+            try:
+                return a4["generate_explanation"](selected, action, root, norm, preferences, alt_trace=alt_trace)
+            except UnboundLocalError:
+                return None  # assignment4 reads selected_factor before it is ever set
+
+        stage("generate_explanation",
+              lambda: pipeline.generate_explanation(annotated, selected, action, norm, preferences,
+                                                    alt_trace=alt_trace, index=index),
+              reference_explanation,
+              lambda result, expected: "skipped" if expected is None else equal(result, expected))
+
+    return {"size": label, "params": config["tree"], "seed": seed, "nodes": len(tree),
+            "traces": len(traces), "exact_traces": forest.count(), "scenario": scenario, "stages": stages}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, old_results):
+    """Print the min-time ratio per stage against an earlier results file, returns the slower ones."""
+    old = {(run["size"], name): stats for run in old_results["runs"] for name, stats in run["stages"].items()}
+    old_nodes = {run["size"]: run["nodes"] for run in old_results["runs"]}
+    slower = []
+    for run in results["runs"]:
+        if old_nodes.get(run["size"], run["nodes"]) != run["nodes"]:
+            print("%-8s different tree (%d nodes, was %d), not compared" % (
+                run["size"], run["nodes"], old_nodes[run["size"]]))
+            continue
+        for name, stats in run["stages"].items():
+            before = old.get((run["size"], name))
+            if before is None:
+                continue
+            ratio = stats["min"] / before["min"] if before["min"] else float("inf")
+            flag = "  SLOWER" if ratio > SLOWER else ""
+            print("%-8s %-24s %8.2fx%s" % (run["size"], name, ratio, flag))
+            if flag:
+                slower.append((run["size"], name, ratio))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="small,medium", help="comma separated, from: " + ", ".join(SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the results as JSON")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    references = {name: load_script_functions(name + ".py") for name in ("ex1", "ex2_test", "assignment4")}
+    results = {
+        "meta": {"date": datetime.datetime.now().isoformat(timespec="seconds"), "commit": _git_commit(),
+                 "python": platform.python_version(), "numpy": np.__version__,
+                 "platform": platform.platform(), "repeat": args.repeat},
+        "runs": [],
+    }
+    mismatches = 0
+    print("%-8s %7s %-24s %10s %10s %8s %10s  %s" % ("size", "nodes", "stage", "ms", "ref ms", "speedup",
+                                                     "peak KB", "check"))
+    for label in args.sizes.split(","):
+        run = run_size(label, SIZES[label], args.repeat, args.seed, references)
+        results["runs"].append(run)
+        for name, stats in run["stages"].items():
+            ref = stats.get("reference_min")
+            print("%-8s %7d %-24s %10.3f %10s %8s %10.1f  %s" % (
+                label, run["nodes"], name, stats["min"] * 1e3,
+                "%.3f" % (ref * 1e3) if ref is not None else "-",
+                "%.1fx" % (ref / stats["min"]) if ref and stats["min"] else "-",
+                stats["peak_bytes"] / 1e3, stats.get("check", "-")))
+            mismatches += stats.get("check") == "mismatch"
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print("results written to", args.out)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
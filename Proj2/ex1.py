@@ -100,4 +100,8 @@ if LOCAL:
     assert all(isinstance(trace, list) for trace in output)
     assert output == expected_output
 
+    # the lazy enumerator of the compiled pipeline gives the same traces
+    from traces import iter_traces
+    assert list(iter_traces(start_node)) == expected_output
+
 print(output)
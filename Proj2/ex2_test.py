@@ -1,5 +1,6 @@
 from anytree.importer import DictImporter
 from anytree import search
+from itertools import zip_longest
 import os
 from anytree import Node, AnyNode, RenderTree
 import json
@@ -107,13 +108,29 @@ if LOCAL:
     if not rendered_tree_str == expected_tree_str:
         print('Trees not the same. \n')
         # Print which lines are not the same, on newlines, with one whitespace after the two lines.
-        for l1, l2 in zip(rendered_tree_str.split('\n'), expected_tree_str.split('\n')):
+        # zip_longest: a missing or extra line is a difference too
+        for l1, l2 in zip_longest(rendered_tree_str.split('\n'), expected_tree_str.split('\n'), fillvalue='<missing>'):
             if l1 != l2:
                 print(f'Result:  {l1}\nCorrect: {l2}\n')
         print("❌ Trees are NOT the same. \n")
     else:
         print("✅ Trees are the same. \n")
 
+    # The compiled (flat-array) tree has to render the same after converting back
+    from goal_tree import SEQ, compile_tree, to_anytree
+    from pipeline import build_annotated_tree
+    from render import diff, render_lines
+    compiled_tree = build_annotated_tree(compile_tree(json_data), norm, any_types=(SEQ,))
+    compiled_tree_str = "\n".join([f"{pre}{node}" for pre, _, node in RenderTree(to_anytree(compiled_tree, clean=True))])
+    assert compiled_tree_str == expected_tree_str, "Compiled tree renders differently"
+    # streamed from the arrays, without the AnyNode tree
+    assert list(render_lines(compiled_tree)) == expected_tree_str.split('\n'), "Streamed rendering differs"
+    # the Merkle hashes locate a wrong annotation without rendering
+    flipped = compiled_tree.violation.copy()
+    flipped[compiled_tree.find('gotoKitchen')] ^= True
+    assert [(compiled_tree.names[i], what) for i, _, what in diff(compiled_tree, compiled_tree.with_violation(flipped))] \
+        == [('gotoKitchen', 'changed')], "Subtree hashes miss a changed annotation"
+
 # 4) Render tree.
 def render_tree_violations_only(tree):
     """Render the tree with violation attribute only."""
@@ -0,0 +1,118 @@
+'''
+Post-condition index and subtree summaries for pruning the trace search.
+
+execution_trace only looks at the goal and the preconditions once it reaches
+an ACT node, so a SEQ whose last step can never run is walked all the way to
+that step first. GoalIndex summarizes every subtree once per tree:
+
+- producers(p): the ACT nodes whose post produces proposition p
+- achieves[i]: bits of the posts of the ACT nodes in the subtree of i, what
+  some trace through it may produce ("can achieve")
+- produced[i]: bits of every post in the subtree, what a SEQ step over it may
+  add to the beliefs of the next step
+- required(goal_check, goal)[i]: bits every trace of the subtree needs in the
+  beliefs it starts from. An ACT needs its pre (unless it may be reached as
+  the goal), a SEQ/AND the needs of each child that the children before it
+  cannot produce, an OR what all its children need.
+
+A subtree whose required bits are not all believed gives no trace, so the
+search can skip it without changing any result. The pre lists declared on
+inner nodes (getKitchenCoffee's) are not checked by execution_trace and are not
+part of the summary; declared_pre(i) has them.
+'''
+
+from beliefs import belief_index
+from goal_tree import ACT, SEQ, AND, OR, derived
+
+
+class GoalIndex:
+    """Producers of each proposition and per-subtree post/pre summaries of one tree."""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.beliefs = belief_index(tree)
+        pre_mask, post_mask = self.beliefs.pre_mask, self.beliefs.post_mask
+        types = tree.types.tolist()
+        parent = tree.parent.tolist()
+        n = len(tree)
+
+        producers = {}
+        for i in range(n):
+            if types[i] == ACT and post_mask[i]:
+                for p in tree.strings("post", i):
+                    producers.setdefault(p, []).append(i)
+        self._producers = {p: tuple(nodes) for p, nodes in producers.items()}
+
+        achieves = [post_mask[i] if types[i] == ACT else 0 for i in range(n)]
+        produced = list(post_mask)
+        # children come after their parent in pre-order
+        for i in range(n - 1, 0, -1):
+            achieves[parent[i]] |= achieves[i]
+            produced[parent[i]] |= produced[i]
+        self.achieves = achieves
+        self.produced = produced
+        self._pre_mask = pre_mask
+        self._required = {}
+
+    def producers(self, proposition):
+        """ACT node ids whose post has proposition, in pre-order."""
+        return self._producers.get(proposition, ())
+
+    def can_achieve(self, i, proposition):
+        """True if an ACT node in the subtree of i produces proposition."""
+        bit = self.beliefs.bit_of.get(proposition)
+        return bit is not None and bool(self.achieves[i] >> bit & 1)
+
+    def declared_pre(self, i):
+        """The pre list of node i as written in the tree, inner nodes included."""
+        return self.tree.strings("pre", i)
+
+    def required(self, goal_check="beliefs", goal=None):
+        """
+        Per node, the bits every trace of its subtree needs at the start (see the
+        module docstring). It depends on which ACT nodes may be reached as the goal:
+        those producing the goal with goal_check="post", any ACT with a post when
+        the goal is a belief set, none otherwise. Cached per goal.
+        """
+        if goal_check == "post":
+            key = ("post", self.beliefs.bit_of.get(goal))
+        else:
+            key = ("beliefs", isinstance(goal, (set, frozenset)))
+        required = self._required.get(key)
+        if required is not None:
+            return required
+
+        tree = self.tree
+        types = tree.types.tolist()
+        post_present = tree.present["post"].tolist()
+        post_mask = self.beliefs.post_mask
+        goal_bit = key[1] if key[0] == "post" else None
+        required = [0] * len(tree)
+        for i in range(len(tree) - 1, -1, -1):
+            node_type = types[i]
+            if node_type == ACT:
+                if key[0] == "post":
+                    reachable = goal_bit is not None and post_mask[i] >> goal_bit & 1
+                else:
+                    reachable = key[1] and post_present[i]
+                required[i] = 0 if reachable else self._pre_mask[i]
+            elif node_type in (SEQ, AND):
+                need, before = 0, 0
+                for child in tree.children(i).tolist():
+                    need |= required[child] & ~before
+                    before |= self.produced[child]
+                required[i] = need
+            elif node_type == OR:
+                kids = tree.children(i).tolist()
+                if kids:
+                    need = required[kids[0]]
+                    for child in kids[1:]:
+                        need &= required[child]
+                    required[i] = need
+        self._required[key] = required
+        return required
+
+
+def goal_index(tree):
+    """Proposition producers and per-subtree post/pre summaries of a tree, built once per tree."""
+    return derived(tree, "goal_index", GoalIndex)
@@ -0,0 +1,442 @@
+'''
+Compiled (flat-array) form of a goal tree.
+
+The assignment scripts walk anytree.AnyNode objects and look attributes up with
+getattr/hasattr on every visit. Here the same tree is stored once as NumPy
+arrays indexed by node id (ids are given in pre-order, so the root is 0 and a
+subtree is the id range [i, end[i])). String lists (pre, post, link, slink) are
+interned into integer ids in a shared symbol table.
+
+Use compile_tree() to go from the JSON dict or an AnyNode tree to a
+CompiledTree, and to_anytree() / to_json() to go back.
+'''
+
+
+from array import array
+import random
+
+from anytree import AnyNode
+import numpy as np
+
+import profiling
+
+# node type codes, unknown types get appended after these
+ACT, SEQ, AND, OR = 0, 1, 2, 3
+TYPE_NAMES = ["ACT", "SEQ", "AND", "OR"]
+
+# list attributes that get interned into the symbol table
+LIST_ATTRS = ["pre", "post", "link", "slink"]
+KNOWN_ATTRS = ["name", "type", "sequence", "costs", "violation"] + LIST_ATTRS
+_SKIP_KEYS = set(KNOWN_ATTRS) | {"children", "parent"}
+
+
+class CompiledTree:
+    """Goal tree stored as flat arrays indexed by pre-order node id."""
+
+    def __init__(self, names, types, type_names, parent, end, depth, child_ptr, child_ids,
+                 sequence, has_sequence, costs, has_costs, costs_int,
+                 symbols, lists, present, violation=None, extra=None):
+        self.names = names                  # list of node names
+        self.types = types                  # int8 type code per node
+        self.type_names = type_names        # type code -> type string
+        self.parent = parent                # int32, -1 for the root
+        self.end = end                      # int32, subtree of i is ids [i, end[i])
+        self.depth = depth                  # int32, root has depth 0
+        self.child_ptr = child_ptr          # int32 CSR offsets into child_ids
+        self.child_ids = child_ids          # int32 children in original order
+        self.sequence = sequence            # int64, 0 where missing
+        self.has_sequence = has_sequence    # bool
+        self.costs = costs                  # float64 (n, dims), zeros where missing
+        self.has_costs = has_costs          # bool
+        self.costs_int = costs_int          # bool, costs were written as ints
+        self.symbols = symbols              # symbol id -> string
+        self.lists = lists                  # attr -> (ptr, ids) CSR over symbol ids
+        self.present = present              # attr -> bool mask, attribute was set
+        self.violation = violation          # bool array, or None if not annotated
+        self.extra = extra if extra is not None else {}  # node id -> other attributes
+
+        self.name_to_id = {name: i for i, name in enumerate(names)}
+        self.symbol_to_id = {s: i for i, s in enumerate(symbols)}
+        # symbol id -> node id with that name (for link/slink), -1 if none
+        self.symbol_node = np.array([self.name_to_id.get(s, -1) for s in symbols], dtype=np.int32)
+        # memoized data derived from the arrays: 'derived' is shared by all annotations
+        # of the same tree, 'annotation_cache' holds what depends on the violations
+        self.derived = {}
+        self.annotation_cache = {}
+        self._ordered = {}
+        self._levels = None
+        self._name_codes = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        # caches are rebuilt on demand, no need to pickle them
+        state = dict(self.__dict__)
+        state.update(derived={}, annotation_cache={}, _ordered={}, _levels=None, _name_codes=None)
+        state.pop("_code_of", None)
+        return state
+
+    @property
+    def dims(self):
+        return self.costs.shape[1]
+
+    def find(self, name):
+        """Node id for a name, or None."""
+        return self.name_to_id.get(name)
+
+    def children(self, i):
+        return self.child_ids[self.child_ptr[i]:self.child_ptr[i + 1]]
+
+    def ordered_children(self, i):
+        """Children sorted by their 'sequence' attribute (0 if missing), like get_traces does."""
+        order = self._ordered.get(i)
+        if order is None:
+            kids = self.children(i)
+            order = kids[np.argsort(self.sequence[kids], kind="stable")].tolist()
+            self._ordered[i] = order
+        return order
+
+    def levels(self):
+        """Node ids grouped by depth, root level first."""
+        if self._levels is None:
+            order = np.argsort(self.depth, kind="stable")
+            bounds = np.cumsum(np.bincount(self.depth))[:-1]
+            self._levels = np.split(order, bounds)
+        return self._levels
+
+    def name_mask(self, names):
+        """Bool mask of the nodes whose name is in names."""
+        if self._name_codes is None:
+            codes = {}
+            self._name_codes = np.array([codes.setdefault(n, len(codes)) for n in self.names],
+                                        dtype=np.int32)
+            self._code_of = codes
+        wanted = [self._code_of[n] for n in names if n in self._code_of]
+        return np.isin(self._name_codes, wanted)
+
+    def ids(self, attr, i):
+        """Interned symbol ids of a list attribute of node i."""
+        ptr, ids = self.lists[attr]
+        return ids[ptr[i]:ptr[i + 1]]
+
+    def strings(self, attr, i):
+        return [self.symbols[s] for s in self.ids(attr, i)]
+
+    def type_name(self, i):
+        return self.type_names[self.types[i]]
+
+    def with_violation(self, violation):
+        """Shallow copy sharing all arrays and caches, with a different violation annotation."""
+        tree = CompiledTree(self.names, self.types, self.type_names, self.parent, self.end,
+                            self.depth, self.child_ptr, self.child_ids, self.sequence,
+                            self.has_sequence, self.costs, self.has_costs, self.costs_int,
+                            self.symbols, self.lists, self.present, violation, self.extra)
+        tree.derived = self.derived
+        tree._ordered = self._ordered
+        tree._levels = self._levels
+        if self._name_codes is not None:
+            tree._name_codes, tree._code_of = self._name_codes, self._code_of
+        return tree
+
+
+def _node_items(node):
+    """(attributes, children) of either a JSON dict node or an AnyNode."""
+    if isinstance(node, dict):
+        return node, node.get("children", [])
+    attrs = {k: v for k, v in vars(node).items() if not k.startswith("_")}
+    return attrs, node.children
+
+
+class TreeBuilder:
+    """
+    Column-wise construction of a CompiledTree. Nodes are added in pre-order with
+    add_node(); their attributes can be set any time before finish(), so a
+    streaming parser can fill them in when a node's JSON object closes.
+    """
+
+    def __init__(self):
+        # per-node columns are typed arrays, a few bytes per node instead of
+        # a Python object each
+        self.names = []
+        self.parent, self.depth = array("i"), array("i")
+        self.types = array("h")
+        self.sequence, self.has_sequence = array("q"), array("b")
+        self.violation, self.has_violation = array("b"), False
+        self.type_names = list(TYPE_NAMES)
+        self.type_codes = {t: i for i, t in enumerate(self.type_names)}
+        self.symbols, self.symbol_ids = [], {}
+        # costs and list attributes: values in the order the nodes were set, and
+        # per node where its values start and how many there are (-1: absent)
+        self.cost_flat, self.cost_start, self.cost_count = array("d"), array("i"), array("i")
+        self.costs_int = array("b")
+        self.list_flat = {attr: array("i") for attr in LIST_ATTRS}
+        self.list_start = {attr: array("i") for attr in LIST_ATTRS}
+        self.list_count = {attr: array("i") for attr in LIST_ATTRS}
+        self.extra = {}
+        self.in_order, self._next_set = True, 0
+
+    def add_node(self, parent, depth):
+        """Reserve the next node id, a child of parent (-1 for the root)."""
+        i = len(self.parent)
+        self.parent.append(parent)
+        self.depth.append(depth)
+        return i
+
+    def _intern(self, value, flat):
+        """Append the symbol ids of a list of strings to flat, False if it is not one."""
+        start = len(flat)
+        for s in value:
+            if type(s) is not str:
+                del flat[start:]
+                return False
+            sid = self.symbol_ids.get(s)
+            if sid is None:
+                sid = self.symbol_ids[s] = len(self.symbols)
+                self.symbols.append(s)
+            flat.append(sid)
+        return True
+
+    def set_attrs(self, i, attrs):
+        """Set the attributes of node i from a dict (its 'children' entry is ignored)."""
+        if i >= len(self.names):
+            self._grow(max(len(self.parent), 2 * len(self.names), 64))
+        if i != self._next_set:
+            self.in_order = False
+        self._next_set = i + 1
+        self.names[i] = attrs.get("name")
+        node_type = attrs.get("type")
+        code = self.type_codes.get(node_type)
+        if code is None:
+            code = self.type_codes[node_type] = len(self.type_names)
+            self.type_names.append(node_type)
+        self.types[i] = code
+
+        other = {}
+        seq = attrs.get("sequence")
+        if type(seq) is int:
+            self.sequence[i] = seq
+            self.has_sequence[i] = True
+        elif "sequence" in attrs:
+            other["sequence"] = seq
+
+        costs = attrs.get("costs")
+        if isinstance(costs, (list, tuple)):
+            self.cost_start[i] = len(self.cost_flat)
+            self.cost_count[i] = len(costs)
+            self.cost_flat.extend(costs)
+            self.costs_int[i] = all(type(c) is int for c in costs)
+        elif "costs" in attrs:
+            other["costs"] = costs
+
+        if "violation" in attrs:
+            self.has_violation = True
+            self.violation[i] = bool(attrs["violation"])
+
+        for attr in LIST_ATTRS:
+            value = attrs.get(attr)
+            if type(value) is list:
+                flat = self.list_flat[attr]
+                start = len(flat)
+                if self._intern(value, flat):
+                    self.list_start[attr][i] = start
+                    self.list_count[attr][i] = len(flat) - start
+                    continue
+            if attr in attrs:
+                other[attr] = value
+
+        if attrs.keys() - _SKIP_KEYS:
+            other.update({k: v for k, v in attrs.items() if k not in _SKIP_KEYS})
+        if other:
+            self.extra[i] = other
+
+    def _columns(self):
+        return ([(self.names, None), (self.types, 0), (self.sequence, 0), (self.has_sequence, 0),
+                 (self.cost_start, 0), (self.cost_count, -1), (self.costs_int, 0), (self.violation, 0)]
+                + [(self.list_start[attr], 0) for attr in LIST_ATTRS]
+                + [(self.list_count[attr], -1) for attr in LIST_ATTRS])
+
+    def _grow(self, n):
+        # attribute columns are extended in blocks, a streaming parser sets
+        # them when a node closes, after its children were added
+        missing = n - len(self.names)
+        for column, fill in self._columns():
+            column.extend([fill] * missing)
+
+    def finish(self, violation=None):
+        """Build the CompiledTree; violation overrides any 'violation' attributes."""
+        n = len(self.parent)
+        self._grow(n)
+        for column, _ in self._columns():
+            del column[n:]
+        cost_count = np.array(self.cost_count, dtype=np.int64)
+        has_costs = cost_count >= 0
+        cost_count[~has_costs] = 0
+        dims = int(cost_count.max(initial=0))
+        cost_matrix = np.zeros((n, dims), dtype=np.float64)
+        rows = np.repeat(np.arange(n), cost_count)
+        cols = np.arange(len(rows)) - np.repeat(np.cumsum(cost_count) - cost_count, cost_count)
+        start = np.array(self.cost_start, dtype=np.int64)
+        cost_matrix[rows, cols] = np.array(self.cost_flat)[np.repeat(start, cost_count) + cols]
+
+        parent = np.array(self.parent, dtype=np.int32)
+        depth = np.array(self.depth, dtype=np.int32)
+        # children in pre-order are sorted by parent and, per parent, in original order
+        child_ids = (np.argsort(parent[1:], kind="stable") + 1).astype(np.int32)
+        child_ptr = np.zeros(n + 1, dtype=np.int32)
+        child_ptr[1:] = np.cumsum(np.bincount(parent[1:], minlength=n))
+        # subtree sizes bottom-up by depth level, the subtree of i is [i, i + size)
+        size = np.ones(n, dtype=np.int32)
+        by_depth = np.argsort(depth, kind="stable")
+        bounds = np.cumsum(np.bincount(depth))[:-1]
+        for level in reversed(np.split(by_depth, bounds)[1:]):
+            np.add.at(size, parent[level], size[level])
+        end = (np.arange(n, dtype=np.int32) + size).astype(np.int32)
+
+        lists, present = {}, {}
+        for attr in LIST_ATTRS:
+            count = np.array(self.list_count[attr], dtype=np.int64)
+            present[attr] = count >= 0
+            count = np.maximum(count, 0)
+            ptr = np.zeros(n + 1, dtype=np.int32)
+            ptr[1:] = np.cumsum(count)
+            # gather the ids back into pre-order
+            start = np.array(self.list_start[attr], dtype=np.int64)
+            at = np.repeat(start - ptr[:-1], count) + np.arange(ptr[-1])
+            flat = np.array(self.list_flat[attr], dtype=np.int32)[at]
+            lists[attr] = (ptr, flat.astype(np.int32))
+        symbols = self.symbols if self.in_order else self._renumber(lists)
+
+        if violation is None and self.has_violation:
+            violation = self.violation
+        return CompiledTree(
+            names=self.names,
+            types=np.array(self.types, dtype=np.int8),
+            type_names=self.type_names,
+            parent=parent,
+            end=end,
+            depth=depth,
+            child_ptr=child_ptr,
+            child_ids=child_ids,
+            sequence=np.array(self.sequence, dtype=np.int64),
+            has_sequence=np.array(self.has_sequence, dtype=bool),
+            costs=cost_matrix,
+            has_costs=has_costs,
+            costs_int=np.array(self.costs_int, dtype=bool),
+            symbols=symbols,
+            lists=lists,
+            present=present,
+            violation=np.array(violation, dtype=bool) if violation is not None else None,
+            extra=self.extra,
+        )
+
+    def _renumber(self, lists):
+        """
+        Symbol ids by first use in pre-order, as an in-order build gives them.
+        Rewrites the id arrays in lists and returns the reordered symbol list.
+        """
+        nodes, ids = [], []
+        for k, attr in enumerate(LIST_ATTRS):
+            ptr, flat = lists[attr]
+            nodes.append(np.repeat(np.arange(len(ptr) - 1), np.diff(ptr)) * len(LIST_ATTRS) + k)
+            ids.append(flat)
+        # stable sort: per node and attribute the ids keep their list order
+        used = np.concatenate(ids)[np.argsort(np.concatenate(nodes), kind="stable")]
+        values, first = np.unique(used, return_index=True)
+        order = values[np.argsort(first)].tolist()
+        seen = set(order)
+        order += [s for s in range(len(self.symbols)) if s not in seen]  # interned but unused
+        new_id = np.empty(len(order), dtype=np.int32)
+        new_id[order] = np.arange(len(order), dtype=np.int32)
+        for attr in LIST_ATTRS:
+            ptr, flat = lists[attr]
+            lists[attr] = (ptr, new_id[flat])
+        return [self.symbols[s] for s in order]
+
+
+@profiling.timed("compile_tree")
+def compile_tree(root):
+    """Compile a JSON goal tree (dict) or an AnyNode tree into a CompiledTree."""
+    builder = TreeBuilder()
+    # iterative pre-order walk, deep trees would hit the recursion limit
+    stack = [(root, -1, 0)]
+    while stack:
+        node, parent_id, level = stack.pop()
+        attrs, kids = _node_items(node)
+        i = builder.add_node(parent_id, level)
+        builder.set_attrs(i, attrs)
+        for child in reversed(list(kids)):
+            stack.append((child, i, level + 1))
+    return builder.finish()
+
+
+def as_compiled(tree):
+    """Accept a CompiledTree, a JSON dict or an AnyNode and return a CompiledTree."""
+    if isinstance(tree, CompiledTree):
+        return tree
+    return compile_tree(tree)
+
+
+def derived(tree, key, build):
+    """
+    tree.derived[key], made by build(tree) on first use. Indexes kept there
+    depend only on the structure, with_violation copies share them.
+    """
+    tree = as_compiled(tree)
+    value = tree.derived.get(key)
+    if value is None:
+        value = tree.derived[key] = build(tree)
+    return value
+
+
+def make_rng(seed=None):
+    """random.Random(seed) for reproducible tie-breaks, the random module (as the scripts use) without a seed."""
+    return random.Random(seed) if seed is not None else random
+
+
+def node_attributes(tree, i, clean=False):
+    """
+    Attribute dict of node i as the AnyNode/JSON form has it.
+    With clean=True the output matches annotate_tree in ex2_test.py: empty
+    attributes are dropped and integral float costs are written as ints.
+    """
+    attrs = {"name": tree.names[i], "type": tree.type_name(i)}
+    if tree.has_sequence[i]:
+        attrs["sequence"] = int(tree.sequence[i])
+    if tree.has_costs[i]:
+        row = tree.costs[i].tolist()
+        if tree.costs_int[i] or clean:
+            row = [int(c) if c.is_integer() else c for c in row]
+        if row or not clean:
+            attrs["costs"] = row
+    for attr in LIST_ATTRS:
+        if tree.present[attr][i]:
+            value = tree.strings(attr, i)
+            if value or not clean:
+                attrs[attr] = value
+    if tree.violation is not None:
+        attrs["violation"] = bool(tree.violation[i])
+    if not clean:
+        attrs.update(tree.extra.get(i, {}))
+    return attrs
+
+
+def to_anytree(tree, root=0, clean=False):
+    """Rebuild the AnyNode tree for the subtree at node id root."""
+    nodes = {}
+    for i in range(root, int(tree.end[root])):
+        parent = nodes.get(int(tree.parent[i])) if i != root else None
+        nodes[i] = AnyNode(parent=parent, **node_attributes(tree, i, clean))
+    return nodes[root]
+
+
+def to_json(tree, root=0):
+    """Rebuild the JSON dict (with nested 'children') for the subtree at node id root."""
+    nodes = {}
+    for i in range(root, int(tree.end[root])):
+        data = node_attributes(tree, i)
+        data.pop("violation", None)
+        nodes[i] = data
+        if i != root:
+            nodes[int(tree.parent[i])].setdefault("children", []).append(data)
+    return nodes[root]
@@ -0,0 +1,198 @@
+'''
+Link graph index for the L factor.
+
+generate_explanation in assignment4.py follows 'link' lists one hop at a time
+through a name map, on every call, and loops forever when the links form a
+cycle (or name a node that does not exist). 'slink' lists, the reverse edges
+("these nodes link to me"), are never read. LinkIndex builds the link graph of
+a tree once:
+
+- edges: X -> Y for every Y in X's link list and every X in Y's slink list,
+  names resolved to node ids (names with no node are left out)
+- cycles: strongly connected components with more than one node, or a self link
+- closure: reachable(u) / enables(u, v) and enabled_by(v), bit masks over the
+  nodes that have links, built on first use
+- chain(i): the L factors of the explanation loop from node i, memoized, and
+  cut where the loop would come back to a node it already continued from
+
+    links = link_index(tree)
+    links.chain(tree.find("gotoKitchen"))   # (("gotoKitchen", "getCoffeeKitchen"),)
+    links.enabled_by(tree.find("getCoffeeKitchen"))
+'''
+
+from goal_tree import derived
+
+
+class LinkIndex:
+    """Link/slink graph of one compiled tree, with cycles, closure and L chains."""
+
+    def __init__(self, tree):
+        self.tree = tree
+        symbol_node = tree.symbol_node.tolist()
+        n = len(tree)
+        link_ptr, link_ids = tree.lists["link"]
+        slink_ptr, slink_ids = tree.lists["slink"]
+        link_ptr, link_ids = link_ptr.tolist(), link_ids.tolist()
+        slink_ptr, slink_ids = slink_ptr.tolist(), slink_ids.tolist()
+
+        successors = {}
+        predecessors = {}
+
+        def add_edge(u, v):
+            if v not in successors.setdefault(u, []):
+                successors[u].append(v)
+                predecessors.setdefault(v, []).append(u)
+
+        for i in range(n):
+            for s in link_ids[link_ptr[i]:link_ptr[i + 1]]:
+                if symbol_node[s] >= 0:
+                    add_edge(i, symbol_node[s])
+            for s in slink_ids[slink_ptr[i]:slink_ptr[i + 1]]:
+                if symbol_node[s] >= 0:
+                    add_edge(symbol_node[s], i)
+
+        self.successors = {u: tuple(vs) for u, vs in successors.items()}
+        self.predecessors = {v: tuple(us) for v, us in predecessors.items()}
+        # bit positions of the nodes that take part in any link edge
+        self.nodes = sorted(set(self.successors) | set(self.predecessors))
+        self.position = {node: k for k, node in enumerate(self.nodes)}
+        self.components, self.component_of = self._components()
+        self._reach = None
+        self._reached_by = None
+        self._chains = {}
+
+    def _components(self):
+        """Strongly connected components (iterative Tarjan), sinks first."""
+        successors = self.successors
+        index_of, low, on_stack = {}, {}, set()
+        stack, components = [], []
+        for start in self.nodes:
+            if start in index_of:
+                continue
+            work = [(start, 0)]
+            while work:
+                node, k = work.pop()
+                if k == 0:
+                    index_of[node] = low[node] = len(index_of)
+                    stack.append(node)
+                    on_stack.add(node)
+                targets = successors.get(node, ())
+                if k < len(targets):
+                    work.append((node, k + 1))
+                    target = targets[k]
+                    if target not in index_of:
+                        work.append((target, 0))
+                    elif target in on_stack:
+                        low[node] = min(low[node], index_of[target])
+                    continue
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index_of[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(tuple(sorted(component)))
+        component_of = {}
+        for c, component in enumerate(components):
+            for node in component:
+                component_of[node] = c
+        return components, component_of
+
+    def targets(self, i):
+        """Node ids i links to (its link list and the slink lists naming it)."""
+        return self.successors.get(i, ())
+
+    def enablers(self, i):
+        """Node ids that link to i, the direct 'which actions enable i' answer."""
+        return self.predecessors.get(i, ())
+
+    def cyclic(self, i):
+        """True if following links from i can come back to i."""
+        c = self.component_of.get(i)
+        return c is not None and (len(self.components[c]) > 1 or i in self.successors.get(i, ()))
+
+    def cycles(self):
+        """The node id tuples of the link cycles (strongly connected components)."""
+        return [component for component in self.components
+                if len(component) > 1 or component[0] in self.successors.get(component[0], ())]
+
+    def _closure(self, edges):
+        """Per graph node, mask of the nodes reachable over one or more edges."""
+        position = self.position
+        component_of = self.component_of
+        members = []
+        for component in self.components:
+            mask = 0
+            for node in component:
+                mask |= 1 << position[node]
+            members.append(mask)
+        # components come sinks first for successors, so walk them in the edge direction
+        order = range(len(self.components)) if edges is self.successors else reversed(range(len(self.components)))
+        reach = [0] * len(self.components)
+        for c in order:
+            mask = 0
+            for node in self.components[c]:
+                for target in edges.get(node, ()):
+                    t = component_of[target]
+                    mask |= members[t] | (reach[t] if t != c else 0)
+            reach[c] = mask
+        return {node: reach[component_of[node]] for node in self.nodes}
+
+    def _mask_nodes(self, mask):
+        nodes = self.nodes
+        return frozenset(nodes[k] for k in range(mask.bit_length()) if mask >> k & 1)
+
+    def reachable(self, i):
+        """Node ids reachable from i over links (i itself only if it is on a cycle)."""
+        if self._reach is None:
+            self._reach = self._closure(self.successors)
+        return self._mask_nodes(self._reach.get(i, 0))
+
+    def enables(self, u, v):
+        """True if a chain of links leads from u to v, O(1) after the closure is built."""
+        if self._reach is None:
+            self._reach = self._closure(self.successors)
+        k = self.position.get(v)
+        return k is not None and bool(self._reach.get(u, 0) >> k & 1)
+
+    def enabled_by(self, v):
+        """Node ids with a chain of links to v, the transitive enablers."""
+        if self._reached_by is None:
+            self._reached_by = self._closure(self.predecessors)
+        return self._mask_nodes(self._reached_by.get(v, 0))
+
+    def chain(self, i):
+        """
+        ((from name, to name), ...) of the L factors generate_explanation adds for
+        action node i. Like assignment4, each step goes through the whole link list
+        of the current node, moving on at every name that is a node; it stops at a
+        node without links or one it already continued from (the AnyNode version
+        loops forever there).
+        """
+        chain = self._chains.get(i)
+        if chain is not None:
+            return chain
+        tree = self.tree
+        node_of = tree.name_to_id
+        has_link = tree.present["link"]
+        steps = []
+        seen = set()
+        current = i
+        while has_link[current] and len(tree.ids("link", current)) and current not in seen:
+            seen.add(current)
+            for name in tree.strings("link", current):
+                steps.append((tree.names[current], name))
+                if name in node_of:
+                    current = node_of[name]
+        chain = self._chains[i] = tuple(steps)
+        return chain
+
+
+def link_index(tree):
+    """Link graph of a tree (cycles, closure, L chains), built once per tree."""
+    return derived(tree, "link_index", LinkIndex)
@@ -0,0 +1,197 @@
+'''
+Fast goal-tree loading with a binary cache.
+
+load_tree("coffee.json") parses the JSON straight into a CompiledTree (no
+DictImporter, no AnyNode objects) and writes a binary copy next to the source,
+".coffee.json.gtree". The next load memory-maps that file instead: the arrays
+are used in place, only the names and symbol lists are decoded. The cache is
+versioned and tied to the source by size/mtime and, if those changed, by a
+content hash, so editing the JSON rebuilds it, as does a truncated or
+unreadable cache file.
+
+Format: MAGIC, a little-endian u32 header length, a JSON header (format
+version, source hash, string lists, array table) and the raw arrays, each
+aligned to 16 bytes.
+'''
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from goal_tree import LIST_ATTRS, CompiledTree, compile_tree, to_anytree
+
+try:
+    import orjson  # optional, about twice as fast on large files
+except ImportError:
+    orjson = None
+
+MAGIC = b"GTREE\0"
+FORMAT_VERSION = 1
+ALIGN = 16
+
+
+def cache_path(json_path):
+    head, tail = os.path.split(json_path)
+    return os.path.join(head, "." + tail + ".gtree")
+
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def parse_json(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def load_tree(file_name="coffee.json", use_cache=True, anynode=False):
+    """
+    Load a goal tree JSON file (relative paths are taken from this directory) as a
+    CompiledTree, through the binary cache when it is up to date. anynode=True
+    returns the AnyNode form instead.
+    """
+    json_path = os.path.join(os.path.dirname(__file__), file_name)
+    tree = None
+    if use_cache:
+        tree = _load_cached(json_path)
+    if tree is None:
+        with open(json_path, "rb") as f:
+            data = f.read()
+        tree = compile_tree(parse_json(data))
+        if use_cache:
+            try:
+                save_compiled(tree, cache_path(json_path), _source_info(json_path, data))
+            except OSError:
+                pass  # read-only location, just skip the cache
+    return to_anytree(tree) if anynode else tree
+
+
+def _source_info(json_path, data=None):
+    stat = os.stat(json_path)
+    info = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if data is not None:
+        info["hash"] = content_hash(data)
+    return info
+
+
+def _load_cached(json_path):
+    path = cache_path(json_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        header, buffer = _read_header(path)
+        if header.get("version") != FORMAT_VERSION:
+            return None
+        source = header["source"]
+        current = _source_info(json_path)
+        touched = (current["size"], current["mtime_ns"]) != (source["size"], source["mtime_ns"])
+        if touched:
+            # compare the contents before trusting the cache
+            with open(json_path, "rb") as f:
+                if content_hash(f.read()) != source["hash"]:
+                    return None
+        tree = _from_header(header, buffer)
+    except (OSError, ValueError, KeyError, struct.error):
+        return None  # unreadable or truncated, load_tree rebuilds it
+    if touched:
+        # same contents: stamp the new size/mtime so the next load skips the hash
+        current["hash"] = source["hash"]
+        try:
+            save_compiled(tree, path, current)
+        except OSError:
+            pass  # read-only location, hash again next time
+    return tree
+
+
+def save_compiled(tree, path, source):
+    """Write a CompiledTree in the binary cache format."""
+    arrays = {
+        "types": tree.types, "parent": tree.parent, "end": tree.end, "depth": tree.depth,
+        "child_ptr": tree.child_ptr, "child_ids": tree.child_ids,
+        "sequence": tree.sequence, "has_sequence": tree.has_sequence,
+        "costs": tree.costs, "has_costs": tree.has_costs, "costs_int": tree.costs_int,
+    }
+    for attr in LIST_ATTRS:
+        arrays[attr + "_ptr"], arrays[attr + "_ids"] = tree.lists[attr]
+        arrays[attr + "_present"] = tree.present[attr]
+    if tree.violation is not None:
+        arrays["violation"] = tree.violation
+
+    table, offset = {}, 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        table[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header = json.dumps({
+        "version": FORMAT_VERSION,
+        "source": source,
+        "names": tree.names,
+        "type_names": tree.type_names,
+        "symbols": tree.symbols,
+        "extra": {str(i): attrs for i, attrs in tree.extra.items()},
+        "arrays": table,
+    }).encode("utf-8")
+    start = -(-(len(MAGIC) + 4 + len(header)) // ALIGN) * ALIGN
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(start + table[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+    os.replace(tmp_path, path)  # readers never see a half-written cache
+
+
+def _read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("not a goal tree cache: " + path)
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (length,) = struct.unpack_from("<I", buffer, len(MAGIC))
+    header_end = len(MAGIC) + 4 + length
+    header = json.loads(buffer[len(MAGIC) + 4:header_end])
+    header["_start"] = -(-header_end // ALIGN) * ALIGN
+    return header, buffer
+
+
+def read_compiled(path):
+    """Memory-map a binary cache file as a CompiledTree (arrays are read-only views)."""
+    header, buffer = _read_header(path)
+    return _from_header(header, buffer)
+
+
+def _from_header(header, buffer):
+    start = header["_start"]
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+        if start + spec["offset"] + count * dtype.itemsize > len(buffer):
+            raise ValueError("goal tree cache is truncated in array %r" % name)
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                     offset=start + spec["offset"]).reshape(spec["shape"])
+    return CompiledTree(
+        names=header["names"],
+        types=arrays["types"],
+        type_names=header["type_names"],
+        parent=arrays["parent"],
+        end=arrays["end"],
+        depth=arrays["depth"],
+        child_ptr=arrays["child_ptr"],
+        child_ids=arrays["child_ids"],
+        sequence=arrays["sequence"],
+        has_sequence=arrays["has_sequence"],
+        costs=arrays["costs"],
+        has_costs=arrays["has_costs"],
+        costs_int=arrays["costs_int"],
+        symbols=header["symbols"],
+        lists={attr: (arrays[attr + "_ptr"], arrays[attr + "_ids"]) for attr in LIST_ATTRS},
+        present={attr: arrays[attr + "_present"] for attr in LIST_ATTRS},
+        violation=arrays.get("violation"),
+        extra={int(i): attrs for i, attrs in header["extra"].items()},
+    )
@@ -0,0 +1,174 @@
+'''
+Load test for server.py: latency percentiles of /explain under concurrency.
+
+Scenarios are drawn with synthetic.synthetic_scenario for the goal tree, and
+--distinct of them are cycled through the requests, so repeats exercise the
+warm caches and concurrent repeats the request coalescing. Without --url a
+server is started in this process on a free port.
+
+    python loadtest.py --requests 2000 --concurrency 8
+    python loadtest.py --url http://127.0.0.1:8000 --tree big.json --inline
+    python loadtest.py --synthetic 6 --distinct 500
+'''
+
+import argparse
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from goal_tree import ACT
+from pipeline import build_annotated_tree, top_k_traces
+from server import make_server
+from synthetic import synthetic_scenario, synthetic_tree
+
+
+def _propositions(tree):
+    props, stack = set(), [tree]
+    while stack:
+        data = stack.pop()
+        props.update(data.get("pre", []))
+        props.update(data.get("post", []))
+        stack.extend(data.get("children", []))
+    return sorted(props)
+
+
+def _explainable(tree, scenario, seed):
+    """
+    The scenario with an action of its selected trace (with this seed), the
+    pipeline rejects explaining any other action, as assignment4 does.
+    """
+    annotated = build_annotated_tree(tree, scenario["norm"])
+    ranked = top_k_traces(annotated, set(scenario["beliefs"]), scenario["goal"], scenario["preferences"])
+    if len(ranked):
+        names = ranked.selection(seed)[0][0][0]
+        if scenario["action_to_explain"] not in names:
+            acts = [name for name in names if annotated.types[annotated.find(name)] == ACT]
+            scenario["action_to_explain"] = acts[seed % len(acts)]
+    return scenario
+
+
+def _post(conn, path, body):
+    conn.request("POST", path, body, {"Content-Type": "application/json"})
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def run(url, tree, n_requests=1000, concurrency=8, distinct=100, inline=False, props=None, seed=0):
+    """Send the requests, returns a dict with the latency percentiles (ms) and counts."""
+    parts = urllib.parse.urlsplit(url)
+    props = _propositions(tree) if props is None else props
+    scenarios = [_explainable(tree, synthetic_scenario(tree, props, seed=seed + k), seed) for k in range(distinct)]
+
+    conn = http.client.HTTPConnection(parts.hostname, parts.port)
+    status, body = _post(conn, "/trees", json.dumps(tree))
+    if status != 200:
+        raise RuntimeError("uploading the tree failed: %s" % body.decode())
+    tree_hash = json.loads(body)["tree_hash"]
+
+    bodies = []
+    for scenario in scenarios:
+        request = {field: scenario[field] for field in ("norm", "beliefs", "goal", "preferences",
+                                                        "action_to_explain")}
+        request["seed"] = seed
+        if inline:
+            request["json_tree"] = tree
+        else:
+            request["tree_hash"] = tree_hash
+        bodies.append(json.dumps(request))
+
+    jobs = queue.Queue()
+    for k in range(n_requests):
+        jobs.put(bodies[k % len(bodies)])
+    latencies, statuses = [], []
+    lock = threading.Lock()
+
+    def worker():
+        client = http.client.HTTPConnection(parts.hostname, parts.port)
+        own_latencies, own_statuses = [], []
+        while True:
+            try:
+                body = jobs.get_nowait()
+            except queue.Empty:
+                break
+            started = time.perf_counter()
+            status, _ = _post(client, "/explain", body)
+            own_latencies.append(time.perf_counter() - started)
+            own_statuses.append(status)
+        client.close()
+        with lock:
+            latencies.extend(own_latencies)
+            statuses.extend(own_statuses)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    conn.request("GET", "/stats")
+    server_stats = json.loads(conn.getresponse().read())
+    conn.close()
+    ms = np.array(latencies) * 1e3
+    return {
+        "requests": len(ms), "errors": sum(status != 200 for status in statuses),
+        "concurrency": concurrency, "distinct": distinct, "inline": inline,
+        "seconds": seconds, "requests_per_second": len(ms) / seconds if seconds else None,
+        "p50_ms": float(np.percentile(ms, 50)), "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)), "max_ms": float(ms.max()),
+        "server": server_stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="server to test, default: start one in this process")
+    parser.add_argument("--tree", default="coffee.json", help="goal tree file (relative to this directory)")
+    parser.add_argument("--synthetic", type=int, metavar="DEPTH", help="use a synthetic tree of this depth instead")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--distinct", type=int, default=100, help="distinct scenarios to cycle through")
+    parser.add_argument("--inline", action="store_true", help="send the tree with every request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    props = None
+    if args.synthetic is not None:
+        tree, props = synthetic_tree(depth=args.synthetic, seed=args.seed)
+    else:
+        with open(os.path.join(os.path.dirname(__file__), args.tree)) as f:
+            tree = json.load(f)
+
+    server = None
+    url = args.url
+    if url is None:
+        server = make_server(port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://%s:%d" % server.server_address[:2]
+    try:
+        results = run(url, tree, args.requests, args.concurrency, args.distinct, args.inline, props, args.seed)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    print("%d requests, %d errors, concurrency %d, %.1f req/s" % (
+        results["requests"], results["errors"], results["concurrency"], results["requests_per_second"]))
+    print("latency ms: p50 %.2f  p90 %.2f  p99 %.2f  max %.2f" % (
+        results["p50_ms"], results["p90_ms"], results["p99_ms"], results["max_ms"]))
+    print("server:", json.dumps(results["server"]))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+'''
+Norm annotation without rebuilding the tree.
+
+build_annotated_tree / annotate_tree rebuild everything from JSON for every
+norm. NormAnnotator keeps a compiled tree and its violation array, and when the
+norm changes only walks up from the ACT nodes whose violation actually flips,
+stopping as soon as an ancestor keeps its value. violation_matrix() annotates
+many norms at once.
+
+Rules are the same as in the assignments: an ACT node violates a P norm when it
+is in the actions and an O norm when it is not, SEQ/AND nodes violate when any
+child does, OR nodes when all children do.
+'''
+
+import numpy as np
+
+from goal_tree import ACT, SEQ, AND, OR, as_compiled
+from pipeline import annotate, propagate
+import profiling
+
+
+class NormAnnotator:
+    """Violation annotation of one tree that follows norm changes incrementally."""
+
+    def __init__(self, tree, norm, any_types=(SEQ, AND)):
+        self.tree = as_compiled(tree)
+        self.any_types = tuple(any_types)
+        self.any_rule = np.isin(self.tree.types, self.any_types)
+        self.all_rule = self.tree.types == OR
+        self.n_children = np.diff(self.tree.child_ptr)
+        self.norm_type = None
+        self.actions = set()
+        self.violation = np.zeros(len(self.tree), dtype=bool)
+        self.n_violating = np.zeros(len(self.tree), dtype=np.int32)
+        self.version = 0  # bumped whenever some violation changes
+        self.changed = np.zeros(0, dtype=np.int32)  # nodes changed by the last update
+        self.set_norm(norm)
+
+    @property
+    def norm(self):
+        return {"type": self.norm_type, "actions": sorted(self.actions)}
+
+    def annotated(self):
+        """Compiled tree carrying the current annotation (a snapshot)."""
+        return self.tree.with_violation(self.violation.copy())
+
+    def set_norm(self, norm):
+        """Switch to a new norm, re-annotating only what differs from the current one."""
+        norm_type = norm.get("type")
+        actions = set(norm.get("actions", []))
+        if norm_type != self.norm_type:
+            self.norm_type, self.actions = norm_type, actions
+            return self._rebuild()
+        return self.update(added=actions - self.actions, removed=self.actions - actions)
+
+    def flip(self):
+        """P <-> O with the same actions, every ACT node flips so this is a full pass."""
+        self.norm_type = {"P": "O", "O": "P"}.get(self.norm_type, self.norm_type)
+        return self._rebuild()
+
+    def update(self, added=(), removed=(), flip=False):
+        """
+        Add/remove norm actions (and optionally flip the norm type) and fix the
+        violations on the affected ACT-to-root paths. Returns the changed node ids.
+        """
+        added, removed = set(added) - self.actions, set(removed) & self.actions
+        self.actions = (self.actions | added) - removed
+        if flip:
+            return self.flip()
+        if self.norm_type not in ("P", "O"):
+            return self._done([])
+        tree = self.tree
+        touched = np.flatnonzero(tree.name_mask(added | removed) & (tree.types == ACT))
+        changed = []
+        for i in touched.tolist():
+            in_norm = tree.names[i] in self.actions
+            changed.extend(self._set(i, in_norm if self.norm_type == "P" else not in_norm))
+        return self._done(changed)
+
+    def _set(self, i, value):
+        """Set node i and propagate upwards while ancestors change."""
+        tree, violation, n_violating = self.tree, self.violation, self.n_violating
+        changed = []
+        while violation[i] != value:
+            violation[i] = value
+            changed.append(i)
+            parent = tree.parent[i]
+            if parent < 0:
+                break
+            n_violating[parent] += 1 if value else -1
+            if self.any_rule[parent]:
+                value = n_violating[parent] > 0
+            elif self.all_rule[parent]:
+                value = n_violating[parent] == self.n_children[parent]
+            else:
+                break
+            i = parent
+        return changed
+
+    def _rebuild(self):
+        old = self.violation
+        self.violation = annotate(self.tree, self.norm, self.any_types)
+        has_parent = self.tree.parent >= 0
+        self.n_violating = np.bincount(self.tree.parent[has_parent],
+                                       weights=self.violation[has_parent],
+                                       minlength=len(self.tree)).astype(np.int32)
+        return self._done(np.flatnonzero(old != self.violation))
+
+    def _done(self, changed):
+        self.changed = np.asarray(changed, dtype=np.int32)
+        if len(self.changed):
+            self.version += 1
+        return self.changed
+
+
+@profiling.timed("violation_matrix")
+def violation_matrix(tree, norms, any_types=(SEQ, AND)):
+    """Bool matrix (len(norms), nodes): the violation annotation of every norm, in one pass."""
+    tree = as_compiled(tree)
+    n = len(tree)
+    act = tree.types == ACT
+    violation = np.zeros((len(norms), n), dtype=bool)
+    for row, norm in enumerate(norms):
+        norm_type = norm.get("type")
+        if norm_type in ("P", "O"):
+            in_norm = tree.name_mask(norm["actions"])
+            violation[row, act] = in_norm[act] if norm_type == "P" else ~in_norm[act]
+    return propagate(tree, violation, any_types)
+
+
+class NormSet:
+    """
+    Many P/O norms active together. A node is blocked when it violates any of
+    them: an ACT node violates every P norm listing it and every O norm not
+    listing it, SEQ/AND and OR nodes follow their children as for one norm.
+
+    The norms are compiled once into one bit mask per action name (bit k: norm
+    k lists it), so an ACT node costs one dict lookup whatever the number of
+    norms. annotate() gives the bool violation array for the trace search and
+    keeps, per node, the mask of the norms behind its violation; describe()
+    renders them for the N factor. A NormSet can be passed wherever a norm dict
+    is (build_annotated_tree, generate_explanation, run_pipeline).
+    """
+
+    def __init__(self, norms):
+        self.norms = [{"type": norm.get("type"), "actions": list(norm.get("actions", []))} for norm in norms]
+        self.p_norms = {}  # action name -> mask of the P norms listing it
+        self.o_norms = {}  # action name -> mask of the O norms listing it
+        self.o_all = 0
+        for k, norm in enumerate(self.norms):
+            if norm["type"] == "P":
+                for action in norm["actions"]:
+                    self.p_norms[action] = self.p_norms.get(action, 0) | 1 << k
+            elif norm["type"] == "O":
+                self.o_all |= 1 << k
+                for action in norm["actions"]:
+                    self.o_norms[action] = self.o_norms.get(action, 0) | 1 << k
+        self._tree = None  # names list of the tree annotated last
+        self._result = None
+
+    def __len__(self):
+        return len(self.norms)
+
+    def action_mask(self, name):
+        """Mask of the norms an ACT node of this name violates."""
+        return self.p_norms.get(name, 0) | self.o_all & ~self.o_norms.get(name, 0)
+
+    @profiling.timed("norm_set")
+    def annotate(self, tree, any_types=(SEQ, AND)):
+        """Bool violation array of the tree under all norms; per-node norm masks are kept for describe()."""
+        tree = as_compiled(tree)
+        key = (tree.names, tuple(any_types))
+        if self._tree is not None and self._tree[0] is key[0] and self._tree[1] == key[1]:
+            return self._result[0].copy()
+        act_ids = np.flatnonzero(tree.types == ACT).tolist()
+        masks = [0] * len(tree)
+        flags = np.zeros(len(tree), dtype=bool)
+        for i in act_ids:
+            masks[i] = self.action_mask(tree.names[i])
+            flags[i] = masks[i] != 0
+        violation = propagate(tree, flags[None, :], any_types)[0]
+        # a violating SEQ/AND/OR node violates what its violating children do
+        inner = np.isin(tree.types, any_types) | (tree.types == OR)
+        parent = tree.parent
+        for i in np.flatnonzero(violation)[::-1].tolist():
+            p = parent[i]
+            if p >= 0 and violation[p] and inner[p]:
+                masks[p] |= masks[i]
+        self._tree, self._result = key, (violation, masks)
+        return violation.copy()
+
+    def _masks(self, tree):
+        if self._tree is None or self._tree[0] is not tree.names:
+            self.annotate(tree)
+        return self._result[1]
+
+    def violated(self, tree, i):
+        """Indices of the norms node i violates (after annotate on this tree)."""
+        mask = self._masks(as_compiled(tree))[i]
+        return [k for k in range(mask.bit_length()) if mask >> k & 1]
+
+    def describe(self, tree, i):
+        """N factor text of node i: every norm it violates, as 'P(a, b); O(c)'."""
+        return "; ".join(self.norms[k]["type"] + "(" + ", ".join(self.norms[k]["actions"]) + ")"
+                         for k in self.violated(tree, i))
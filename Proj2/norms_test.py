@@ -0,0 +1,41 @@
+'''
+Checks of the incremental NormAnnotator, run with the configured unittest
+discovery:
+
+    python -m unittest discover -s Proj2 -p "*test.py"
+'''
+
+import random
+import unittest
+
+from goal_tree import SEQ, AND, compile_tree
+from norms import NormAnnotator
+from pipeline import annotate
+from synthetic import synthetic_tree
+
+
+class NormAnnotatorTest(unittest.TestCase):
+    """Incremental norm edits end in the annotation of the edited norm made afresh."""
+
+    def test_random_edits(self):
+        tree = compile_tree(synthetic_tree(depth=5, seed=3)[0])
+        names = sorted(set(tree.names))
+        for any_types in ((SEQ,), (SEQ, AND)):
+            rng = random.Random(0)
+            annotator = NormAnnotator(tree, {"type": "P", "actions": rng.sample(names, 3)}, any_types=any_types)
+            for step in range(300):
+                edit = rng.random()
+                if edit < 0.45:
+                    annotator.update(added=rng.sample(names, 3))
+                elif edit < 0.9:
+                    annotator.update(removed=rng.sample(sorted(annotator.actions) or names, 1))
+                elif edit < 0.95:
+                    annotator.flip()
+                else:
+                    annotator.set_norm({"type": rng.choice("PO"), "actions": rng.sample(names, 4)})
+                self.assertTrue((annotator.violation == annotate(tree, annotator.norm, any_types)).all(),
+                                "edit %d (any_types %s)" % (step, any_types))
+
+
+if __name__ == "__main__":
+    unittest.main()
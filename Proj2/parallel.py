@@ -0,0 +1,58 @@
+'''
+Parallel explanation generation over large scenario sets.
+
+The compiled tree is pickled once per worker process (pool initializer), the
+scenarios are sent in chunks and every worker runs batch.evaluate_batch on its
+chunk. Results come back in input order.
+
+On platforms that spawn workers (Windows, macOS) call explain_parallel from
+under an `if __name__ == "__main__":` guard.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import random
+
+from batch import evaluate_batch
+from goal_tree import as_compiled
+
+_worker_tree = None
+
+
+def _init_worker(tree):
+    global _worker_tree
+    _worker_tree = tree
+
+
+def _run_chunk(job):
+    start, chunk, seed, goal_check = job
+    if seed is not None:
+        # seeded per chunk, so ties are broken the same for any number of workers
+        random.seed(seed + start)
+    return evaluate_batch(_worker_tree, chunk, goal_check=goal_check)
+
+
+def explain_parallel(json_tree, scenarios, workers=None, chunk_size=64, seed=None, goal_check="beliefs"):
+    """
+    evaluate_batch over a process pool: [(selected_trace, output)] per scenario.
+    workers defaults to the number of cores, workers=1 runs in this process.
+    With a seed the random tie-breaks do not depend on workers or scheduling.
+    """
+    tree = as_compiled(json_tree)
+    jobs = [(start, scenarios[start:start + chunk_size], seed, goal_check)
+            for start in range(0, len(scenarios), chunk_size)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs)) or 1
+
+    results = []
+    if workers == 1:
+        _init_worker(tree)
+        for job in jobs:
+            results.extend(_run_chunk(job))
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(tree,)) as pool:
+        for part in pool.map(_run_chunk, jobs):
+            results.extend(part)
+    return results
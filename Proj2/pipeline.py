@@ -0,0 +1,719 @@
+'''
+The assignment3/assignment4 stages on a CompiledTree (see goal_tree.py).
+
+Same functions and same outputs as the AnyNode versions, but nodes are ints:
+traces are lists of node ids and the annotation is a bool array on the tree.
+
+    tree = build_annotated_tree(json_tree, norm)
+    tracelist = execution_trace(tree, set(beliefs), goal)
+    selected, nonselected = pick_lowest_cost_trace(tree, tracelist, preferences)
+    output = generate_explanation(tree, selected, action_to_explain, norm, preferences, nonselected)
+'''
+
+import heapq
+import numpy as np
+
+from beliefs import belief_index
+from goal_index import goal_index
+from goal_tree import ACT, SEQ, AND, OR, as_compiled, derived, make_rng
+from links import link_index
+import profiling
+from selection import select
+from traces import TraceArray, all_traces, iter_traces
+from tree_index import tree_index
+
+
+@profiling.timed("annotate")
+def annotate(tree, norm, any_types=(SEQ, AND)):
+    """
+    Violation per node: ACT nodes from the norm, nodes of any_types if any child
+    violates, OR nodes if all children violate. Returns a bool array.
+    ex2_test.py's annotate_tree only applies the any-rule to SEQ, use any_types=(SEQ,) for that.
+    norm can also be a norms.NormSet of several norms.
+    """
+    tree = as_compiled(tree)
+    if not isinstance(norm, dict):
+        return norm.annotate(tree, any_types)
+    act = tree.types == ACT
+    violation = np.zeros(len(tree), dtype=bool)
+    norm_type = norm.get("type")
+    if norm_type in ("P", "O"):
+        in_norm = tree.name_mask(norm["actions"])
+        violation[act] = in_norm[act] if norm_type == "P" else ~in_norm[act]
+    return propagate(tree, violation[None, :], any_types)[0]
+
+
+def propagate(tree, flags, any_types=(SEQ, AND)):
+    """
+    Push per-node flags (bool matrix, one row per case) up the tree with the
+    violation rules: any_types nodes get any(children), OR nodes all(children),
+    other nodes keep their own flag. Updates flags in place and returns it.
+    """
+    any_rule = np.isin(tree.types, any_types)
+    all_rule = tree.types == OR
+    n_children = np.diff(tree.child_ptr)
+    n_flagged = np.zeros(flags.shape, dtype=np.int32)
+    # bottom-up one depth level at a time, children are always one level deeper
+    for level in reversed(tree.levels()):
+        count = n_flagged[:, level]
+        flags[:, level] = np.where(any_rule[level], count > 0,
+                                   np.where(all_rule[level], count == n_children[level],
+                                            flags[:, level]))
+        parents = tree.parent[level]
+        has_parent = parents >= 0
+        np.add.at(n_flagged, (slice(None), parents[has_parent]), flags[:, level[has_parent]])
+    return flags
+
+
+def build_annotated_tree(data, norm, any_types=(SEQ, AND)):
+    """Compile (if needed) and annotate, the tree arrays are shared with the input tree."""
+    tree = as_compiled(data)
+    return tree.with_violation(annotate(tree, norm, any_types))
+
+
+@profiling.timed("get_traces")
+def get_traces(tree, node=0, limit=None, compact=False):
+    """
+    All traces (lists of names) of the subtree at node id node, like get_traces in ex1.py.
+    compact=True returns a traces.TraceArray of node ids instead.
+    """
+    if compact:
+        tree = as_compiled(tree)
+        traces = TraceArray.build(tree, iter_traces(tree, node, limit=limit, names=False))
+    elif limit is None:
+        traces = all_traces(tree, node)
+    else:
+        traces = list(iter_traces(tree, node, limit=limit))
+    profiling.count("traces_generated", len(traces))
+    return traces
+
+
+def _trace_visitor(tree, goal, goal_check, unknown, blocked=None, cache=None):
+    """
+    The recursive execution_trace step, as visit(node id, belief mask) ->
+    (first trace of the subtree as an id tuple or None, post mask of its last node).
+    A SEQ/AND only ever uses the first trace of each child, so that is all this
+    builds; the OR choices above the first SEQ/AND/ACT are walked by _or_traces.
+    Beliefs are bit masks from beliefs.py, encode them with the same unknown dict.
+    blocked replaces tree.violation as the set of nodes that give no trace.
+    cache is an optional trace_cache.TraceCache.
+    """
+    index = belief_index(tree)
+    pre_mask, post_mask = index.pre_mask, index.post_mask
+    if goal_check == "post":
+        goal_bit = index.bit_of.get(goal)
+        goal_mask = 1 << goal_bit if goal_bit is not None else 0
+    elif isinstance(goal, (set, frozenset)):
+        goal_mask = index.encode(goal, unknown)
+    else:
+        goal_mask = None  # a non-set goal can never equal the belief set
+    violation = tree.violation if blocked is None else blocked
+    types = tree.types
+    post_present = tree.present["post"]
+    # beliefs every trace of a subtree needs, checked before descending
+    required = goal_index(tree).required(goal_check, goal)
+    no_trace = (None, 0)
+
+    def expand(i, beliefs):
+        if violation is not None and violation[i] or required[i] & beliefs != required[i]:
+            return no_trace
+        node_type = types[i]
+
+        if node_type == ACT:
+            if goal_check == "post":
+                reached = post_mask[i] & goal_mask != 0
+            else:
+                reached = post_present[i] and beliefs == goal_mask
+            if reached or pre_mask[i] & beliefs == pre_mask[i]:
+                return (i,), post_mask[i]
+            return no_trace
+
+        if node_type == OR:
+            # the first child with a trace gives the first trace
+            for child in tree.children(i).tolist():
+                child_trace, post = visit(child, beliefs)
+                if child_trace is not None:
+                    return (i,) + child_trace, post
+            return no_trace
+
+        if node_type in (SEQ, AND):
+            current_trace = (i,)
+            post = post_mask[i]  # an empty sequence ends on the node itself
+            for child in tree.children(i).tolist():
+                child_trace, post = visit(child, beliefs)
+                if child_trace is None:
+                    return no_trace
+                # first successful path only, as in the assignments
+                current_trace += child_trace
+                beliefs |= post
+            return current_trace, post
+
+        return no_trace
+
+    stats = profiling.active()
+    if stats is not None:
+        uncounted = expand
+
+        def expand(i, beliefs):
+            stats.count("nodes_visited")
+            result = uncounted(i, beliefs)
+            if types[i] == OR:
+                # children tried: up to the one giving the first trace
+                kids = tree.children(i).tolist()
+                stats.count("belief_copies", len(kids) if result[0] is None else kids.index(result[0][1]) + 1)
+            return result
+
+    if cache is None:
+        visit = expand
+        return visit if stats is None else _profiled_visit(stats, visit, cache)
+
+    # only the beliefs some precondition in the subtree reads matter, unless the
+    # goal is compared with the whole belief set
+    cache.sync(tree, violation)
+    relevant = index.relevant_masks()
+    if goal_check == "post":
+        goal_key = ("post", goal)
+    elif goal_mask is not None:
+        goal_key = ("beliefs", frozenset(goal), frozenset(unknown.items()))
+        relevant = None
+    else:
+        goal_key = None
+
+    def visit(i, beliefs):
+        key = (i, beliefs if relevant is None else beliefs & relevant[i], goal_key)
+        result = cache.get(key)
+        if result is None:
+            result = expand(i, beliefs)
+            cache.put(key, result)
+        return result
+
+    return visit if stats is None else _profiled_visit(stats, visit, cache)
+
+
+def _profiled_visit(stats, visit, cache):
+    """visit, timing each call from outside as the "expand" stage and counting cache lookups."""
+    def profiled(i, beliefs):
+        hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+        with stats.stage("expand"):
+            result = visit(i, beliefs)
+        if cache is not None:
+            stats.count("cache_hits", cache.hits - hits)
+            stats.count("cache_misses", cache.misses - misses)
+        return result
+
+    return profiled
+
+
+def _or_traces(tree, visit, beliefs, violation, required, needed=0):
+    """
+    Yield (path, suffix) per execution trace, in execution_trace order: path is
+    the OR nodes from the root down to a SEQ/AND/ACT node and suffix that node's
+    first trace. path is one shared list, it changes once the generator resumes.
+    required are goal_index required masks; subtrees whose posts cannot cover
+    the needed bits are skipped.
+    """
+    types = tree.types
+    achieves = goal_index(tree).achieves
+    path = []
+    stack = [(0, 0)]  # (node id, path length)
+    while stack:
+        i, length = stack.pop()
+        del path[length:]
+        if (violation is not None and violation[i] or required[i] & beliefs != required[i]
+                or achieves[i] & needed != needed):
+            continue
+        if types[i] == OR:
+            path.append(i)
+            kids = tree.children(i).tolist()
+            profiling.count("nodes_visited")
+            profiling.count("belief_copies", len(kids))
+            for child in reversed(kids):
+                stack.append((child, length + 1))
+            continue
+        suffix = visit(i, beliefs)[0]
+        if suffix is not None:
+            yield path, suffix
+
+
+def _goal_needed(tree, beliefs, goal):
+    """Bits of the goal propositions (one, or a set) not yet believed; None if one is never produced."""
+    index = belief_index(tree)
+    needed = 0
+    for proposition in goal if isinstance(goal, (set, frozenset)) else [goal]:
+        if proposition in beliefs:
+            continue
+        bit = index.bit_of.get(proposition)
+        if bit is None or not goal_index(tree).producers(proposition):
+            return None
+        needed |= 1 << bit
+    return needed
+
+
+def _posts(trace, post_mask, types):
+    mask = 0
+    for i in trace:
+        if types[i] == ACT:
+            mask |= post_mask[i]
+    return mask
+
+
+@profiling.timed("execution_trace")
+def execution_trace(tree, beliefs, goal, goal_check="beliefs", cache=None, compact=False, require_goal=False):
+    """
+    All execution traces (lists of node ids) from the root, like execution_trace in
+    assignment3/4. goal_check="post" is the assignment3 ACT rule (goal in node.post),
+    "beliefs" the assignment4 one (goal == beliefs). AND is handled like SEQ in both.
+    A trace_cache.TraceCache shared between calls reuses subtree results.
+    compact=True returns a traces.TraceArray instead of lists.
+    require_goal=True keeps only the traces with ACT nodes whose posts produce the
+    goal proposition(s) not already believed, and skips subtrees that cannot
+    (goal_index.py); the assignments return every trace.
+    """
+    tree = as_compiled(tree)
+    unknown = {}
+    beliefs = set(beliefs)
+    belief_mask = belief_index(tree).encode(beliefs, unknown)
+    needed = _goal_needed(tree, beliefs, goal) if require_goal else 0
+    if needed is None:
+        return TraceArray.build(tree, []) if compact else []
+    visit = _trace_visitor(tree, goal, goal_check, unknown, cache=cache)
+    found = _or_traces(tree, visit, belief_mask, tree.violation,
+                       goal_index(tree).required(goal_check, goal), needed)
+    if needed:
+        post_mask, types = belief_index(tree).post_mask, tree.types
+        found = ((path, suffix) for path, suffix in found
+                 if _posts(suffix, post_mask, types) & needed == needed)
+    if compact:
+        traces = TraceArray.build(tree, (path + list(suffix) for path, suffix in found))
+    else:
+        traces = [path + list(suffix) for path, suffix in found]
+    profiling.count("traces_generated", len(traces))
+    return traces
+
+
+@profiling.timed("cost_lower_bounds")
+def cost_lower_bounds(tree, priority_order):
+    """
+    Per node, the lexicographically smallest cost (projected on priority_order) that
+    any trace through its subtree can have, or None if the subtree has no trace at
+    all. Adding costs keeps lexicographic order, so a SEQ/AND bound is the sum of
+    its children's bounds and an OR bound the smallest child bound.
+    Memoized on the annotated tree per priority order.
+    """
+    key = ("cost_lower_bounds", tuple(priority_order))
+    if key in tree.annotation_cache:
+        return tree.annotation_cache[key]
+    projected = tree.costs[:, list(priority_order)]
+    if not np.array_equal(projected, np.round(projected)):
+        # summing in a different order than the trace does can round up, keep some slack
+        projected = projected - 1e-9 * np.maximum(1.0, np.abs(projected)) * len(tree)
+    violation = tree.violation
+    bounds = [None] * len(tree)
+    # children have higher pre-order ids than their parent
+    for i in range(len(tree) - 1, -1, -1):
+        if violation is not None and violation[i]:
+            continue
+        node_type = tree.types[i]
+        if node_type == ACT:
+            bounds[i] = tuple(projected[i].tolist())
+        elif node_type in (SEQ, AND):
+            total = [0.0] * len(priority_order)
+            for child in tree.children(i).tolist():
+                if bounds[child] is None:
+                    total = None
+                    break
+                total = [t + c for t, c in zip(total, bounds[child])]
+            bounds[i] = tuple(total) if total is not None else None
+        elif node_type == OR:
+            child_bounds = [bounds[c] for c in tree.children(i).tolist() if bounds[c] is not None]
+            bounds[i] = min(child_bounds) if child_bounds else None
+    tree.annotation_cache[key] = bounds
+    return bounds
+
+
+@profiling.timed("lowest_cost_trace")
+def lowest_cost_trace(tree, beliefs, goal, importance, goal_check="beliefs", seed=None, cache=None):
+    """
+    execution_trace + pick_lowest_cost_trace without building the whole tracelist.
+
+    Traces only branch at OR nodes, so the OR nodes are searched best-first on
+    their cost_lower_bounds and a child is skipped once its bound is worse than the
+    best trace found so far. Returns the selected part of pick_lowest_cost_trace,
+    [(names, cost)], or [] when there is no trace. Ties are broken exactly like the
+    exhaustive path: with the same seed both pick the same trace.
+    """
+    tree = as_compiled(tree)
+    priority_order = list(importance[1])
+    bounds = cost_lower_bounds(tree, priority_order)
+    unknown = {}
+    belief_mask = belief_index(tree).encode(beliefs, unknown)
+    visit = _trace_visitor(tree, goal, goal_check, unknown, cache=cache)
+    act_costs = act_cost_rows(tree)
+    violation = tree.violation
+
+    best = None
+    found = []  # (position in the exhaustive trace order, trace, cost) with the best bound
+    generated = pruned = 0
+
+    def search(i, prefix, position):
+        nonlocal best, found, generated, pruned
+        if violation is not None and violation[i]:
+            return
+        if tree.types[i] == OR:
+            kids = tree.children(i).tolist()
+            ranked = sorted((k for k in range(len(kids)) if bounds[kids[k]] is not None),
+                            key=lambda k: bounds[kids[k]])
+            pruned += len(kids) - len(ranked)
+            for n, k in enumerate(ranked):
+                if best is not None and bounds[kids[k]] > best:
+                    pruned += len(ranked) - n
+                    break  # every remaining child is worse than the incumbent
+                search(kids[k], prefix + [i], position + (k,))
+            return
+        # below an OR only the first trace is kept
+        suffix = visit(i, belief_mask)[0]
+        if suffix is not None:
+            generated += 1
+            trace = prefix + list(suffix)
+            cost = act_costs[trace].sum(axis=0)
+            key = tuple(cost[priority_order].tolist())
+            if best is None or key < best:
+                best, found = key, [(position, trace, cost)]
+            elif key == best:
+                found.append((position, trace, cost))
+
+    search(0, [], ())
+    profiling.count("traces_generated", generated)
+    profiling.count("traces_pruned", pruned)
+    if not found:
+        return []
+
+    # same tie rule as pick_lowest_cost_trace: the first trace (in execution_trace
+    # order) with the best priority fixes the cost, traces with that exact cost tie
+    found.sort(key=lambda f: f[0])
+    best_cost = found[0][2]
+    ties = [trace for _, trace, cost in found if np.array_equal(cost, best_cost)]
+    rng = make_rng(seed)
+    trace = rng.choice(ties) if len(ties) > 1 else ties[0]
+    return [(trace_names(tree, trace), trace_costs(tree, [trace])[0])]
+
+
+def _act_cost_rows(tree):
+    rows = np.where((tree.types == ACT)[:, None], tree.costs, 0.0)
+    rows.flags.writeable = False  # shared by every query on the tree
+    return rows
+
+
+def act_cost_rows(tree):
+    """(nodes, dims) costs with the rows of non-ACT nodes zeroed (only actions add up in a trace), made once per tree."""
+    return derived(tree, "act_cost_rows", _act_cost_rows)
+
+
+@profiling.timed("trace_costs")
+def trace_costs(tree, tracelist):
+    """(len(tracelist), dims) matrix of summed ACT costs per trace."""
+    tree = as_compiled(tree)
+    act_costs = act_cost_rows(tree)
+    if isinstance(tracelist, TraceArray):
+        lengths = tracelist.lengths()
+    else:
+        lengths = np.fromiter(map(len, tracelist), dtype=np.int64, count=len(tracelist))
+    costs = np.zeros((len(tracelist), tree.dims), dtype=np.float64)
+    if lengths.sum():
+        # all traces at once: bincount adds each trace's rows in trace order
+        if isinstance(tracelist, TraceArray):
+            flat = tracelist.ids
+        else:
+            flat = np.concatenate([np.asarray(trace, dtype=np.int64) for trace in tracelist])
+        rows = np.repeat(np.arange(len(tracelist)), lengths)
+        for dim in range(tree.dims):
+            costs[:, dim] = np.bincount(rows, weights=act_costs[flat, dim], minlength=len(tracelist))
+    if tree.costs_int[tree.has_costs].all():
+        costs = costs.astype(np.int64)
+    return costs
+
+
+@profiling.timed("pick_lowest_cost_trace")
+def pick_lowest_cost_trace(tree, tracelist, importance, seed=None, mode="lexicographic", weights=None):
+    """
+    Same as assignment4: ([(selected names, cost)], [(names, cost) of the others in
+    sorted order]), ties on the lowest cost are broken with random.choice
+    (on random.Random(seed) when a seed is given).
+    mode="weighted" ranks on costs @ weights and mode="pareto" picks among the
+    Pareto-optimal traces instead, see selection.py.
+    """
+    if not tracelist:
+        return []
+    tree = as_compiled(tree)
+    costs = trace_costs(tree, tracelist)
+
+    # costs are [quality, price, time], importance[1] is the priority order
+    order, best_traces_indices = select(costs, mode, importance[1], weights)
+
+    rng = make_rng(seed)
+    selected_trace_index = rng.choice(best_traces_indices) if len(best_traces_indices) > 1 else best_traces_indices[0]
+
+    selected_trace = [(trace_names(tree, tracelist[selected_trace_index]), costs[selected_trace_index])]
+    non_selected_traces = [(trace_names(tree, tracelist[idx]), costs[idx])
+                           for idx in order.tolist() if idx != selected_trace_index]
+    return selected_trace, non_selected_traces
+
+
+class RankedTraces:
+    """
+    The best traces in pick_lowest_cost_trace order: costs is a (rows, dims) matrix
+    and traces the matching node id lists. All traces tied on the best cost are
+    always kept (there can be more than k), so selection() can break the tie the
+    same way pick_lowest_cost_trace does.
+    """
+
+    def __init__(self, tree, traces, costs, best_rows):
+        self.tree = tree
+        self.traces = traces
+        self.costs = costs
+        self.best_rows = best_rows  # rows tied on the lowest cost
+
+    def __len__(self):
+        return len(self.traces)
+
+    def names(self, k):
+        return trace_names(self.tree, self.traces[k])
+
+    def selection(self, seed=None):
+        """(selected, non_selected) in the format of pick_lowest_cost_trace, non_selected cut to the kept rows."""
+        if not self.traces:
+            return []
+        rng = make_rng(seed)
+        chosen = rng.choice(self.best_rows) if len(self.best_rows) > 1 else self.best_rows[0]
+        selected = [(self.names(chosen), self.costs[chosen])]
+        non_selected = [(self.names(k), self.costs[k]) for k in range(len(self.traces)) if k != chosen]
+        return selected, non_selected
+
+
+@profiling.timed("top_k_traces")
+def top_k_traces(tree, beliefs, goal, importance, k=2, goal_check="beliefs", blocked=None, cache=None):
+    """
+    The k cheapest traces of execution_trace without building the tracelist.
+
+    Every subtree below an OR keeps at most one trace, so its cost is summed once
+    from the per-node cost rows. Each OR node merges the already sorted candidate
+    lists of its children and keeps the best k (plus ties on its best cost).
+    k=2 is enough for generate_explanation, which only looks at alt_trace[0].
+    blocked (a bool array, see batch.py) can stand in for tree.violation.
+    """
+    tree = as_compiled(tree)
+    priority_order = list(importance[1])
+    unknown = {}
+    belief_mask = belief_index(tree).encode(beliefs, unknown)
+    visit = _trace_visitor(tree, goal, goal_check, unknown, blocked, cache)
+    act_costs = act_cost_rows(tree)
+    violation = tree.violation if blocked is None else blocked
+    generated = pruned = 0
+
+    def candidates(i, prefix, position):
+        """Sorted [(priority key, position, trace, cost)] of the subtree at i."""
+        nonlocal generated, pruned
+        if violation is not None and violation[i]:
+            return []
+        if tree.types[i] == OR:
+            children = [candidates(child, prefix + [i], position + (n,))
+                        for n, child in enumerate(tree.children(i).tolist())]
+            kept = []
+            for n, cand in enumerate(heapq.merge(*children, key=lambda c: c[:2])):
+                if n >= k and cand[0] != kept[0][0]:
+                    break
+                kept.append(cand)
+            pruned += sum(map(len, children)) - len(kept)
+            return kept
+        suffix = visit(i, belief_mask)[0]
+        if suffix is None:
+            return []
+        generated += 1
+        trace = prefix + list(suffix)
+        cost = act_costs[trace].sum(axis=0)
+        return [(tuple(cost[priority_order].tolist()), position, trace, cost)]
+
+    found = candidates(0, [], ())
+    profiling.count("traces_generated", generated)
+    profiling.count("traces_pruned", pruned)
+    if not found:
+        return RankedTraces(tree, [], np.zeros((0, tree.dims)), [])
+    # ties on the exact best cost, the rest is cut back to k rows
+    best_rows = [row for row, cand in enumerate(found) if np.array_equal(cand[3], found[0][3])]
+    found = found[:max(k, best_rows[-1] + 1)]
+    traces = [cand[2] for cand in found]
+    return RankedTraces(tree, traces, trace_costs(tree, traces), best_rows)
+
+
+def trace_names(tree, trace):
+    return [tree.names[i] for i in trace]
+
+
+def _norm_text(tree, norm, i):
+    """The N factor text: the norm, or the norms of a NormSet that node i violates."""
+    if isinstance(norm, dict):
+        return norm["type"] + "(" + ", ".join(norm["actions"]) + ")"
+    return norm.describe(tree, i)
+
+
+class ExplanationContext:
+    """
+    generate_explanation for one selected trace and any action of it.
+
+    Only the P, L and D factors depend on action_to_explain: the C/N/V/F factors
+    of the OR nodes and the candidate P factors are computed once per trace
+    here, an explanation is then two slices of them plus the action's link chain
+    (links.py) and goal chain (tree_index.py).
+    """
+
+    def __init__(self, tree, trace, norm, preferences, alt_trace=None, index=None):
+        tree = as_compiled(tree)
+        self.tree = tree
+        self.index = tree_index(tree) if index is None else index
+        self.preferences = preferences
+        self.names = trace[0][0]
+        self.nodes, in_trace, trace_name_set = self.index.trace(self.names)
+        violation = tree.violation
+        has_costs, has_pre = tree.has_costs, tree.present["pre"]
+        selected_factor = None
+
+        def raw_costs(i):
+            row = tree.costs[i].tolist()
+            return [int(c) for c in row] if tree.costs_int[i] else row
+
+        # per trace position: the OR factors, and the P factor if the node has pre
+        self.or_factors, self.p_factors = [], []
+        for node in self.nodes:
+            factors = []
+            if tree.types[node] == OR:
+                selected = None
+                non_selected = []
+                for child in tree.children(node).tolist():
+                    if child in in_trace:
+                        selected = child
+                    else:
+                        non_selected.append(child)
+
+                if selected is not None:
+                    factors.append(["C", tree.names[selected], tree.strings("pre", selected)])
+                for alt in non_selected:
+                    possible_factors = []
+                    if violation is not None and violation[alt]:
+                        possible_factors.append(["N", tree.names[alt], _norm_text(tree, norm, alt)])
+
+                    selected_has_costs = selected is not None and has_costs[selected]
+                    if not (has_costs[alt] or selected_has_costs) and alt_trace is not None:
+                        possible_factors.append(["V", tree.names[selected], trace[0][1].tolist(), ">",
+                                                 tree.names[alt], alt_trace[0][1].tolist()])
+                    elif has_costs[alt] and selected_has_costs:
+                        possible_factors.append(["V", tree.names[selected], raw_costs(selected), ">",
+                                                 tree.names[alt], raw_costs(alt)])
+
+                    if has_pre[alt]:
+                        missing = [p for p in tree.strings("pre", alt) if p not in trace_name_set]
+                        if missing:
+                            possible_factors.append(["F", tree.names[alt], missing])
+                    # with no factors the previous one is repeated, as in assignment4
+                    if possible_factors:
+                        selected_factor = possible_factors[0]
+                    if selected_factor:
+                        factors.append(selected_factor)
+            self.or_factors.append(factors)
+            has_p = tree.types[node] == ACT and has_pre[node]
+            self.p_factors.append(["P", tree.names[node], tree.strings("pre", node)] if has_p else None)
+
+        # the same factors flattened, with and without the P factors, and where
+        # each position starts in them
+        self._with_p, self._without_p = [], []
+        self._with_p_start, self._without_p_start = [], []
+        for factors, p_factor in zip(self.or_factors, self.p_factors):
+            self._with_p_start.append(len(self._with_p))
+            self._without_p_start.append(len(self._without_p))
+            self._with_p.extend(factors)
+            self._without_p.extend(factors)
+            if p_factor is not None:
+                self._with_p.append(p_factor)
+        self._with_p_start.append(len(self._with_p))
+        self._without_p_start.append(len(self._without_p))
+        self._unique = len(set(self.names)) == len(self.names)
+
+    def explain(self, action_to_explain):
+        """The factor list of generate_explanation for an action of the trace."""
+        tree, index = self.tree, self.index
+        if action_to_explain not in index.node_of:
+            return []
+        position = self.names.index(action_to_explain)
+        node = self.nodes[position]
+        links = [["L", name, "->", linked] for name, linked in link_index(tree).chain(node)]
+        if self._unique:
+            # P factors up to the action, its links, then the OR factors after it
+            explanation = (self._with_p[:self._with_p_start[position + 1]] + links
+                           + self._without_p[self._without_p_start[position + 1]:])
+        else:
+            # a repeated name: P factors go by name, links follow every node of that name
+            before_action = set(self.names[:position + 1])
+            explanation = []
+            for k, name in enumerate(self.names):
+                explanation.extend(self.or_factors[k])
+                if self.p_factors[k] is not None and name in before_action:
+                    explanation.append(self.p_factors[k])
+                if name == action_to_explain:
+                    explanation.extend(["L", linked_from, "->", linked]
+                                       for linked_from, linked in link_index(tree).chain(self.nodes[k]))
+
+        # "D" Factor: Goals
+        action_node = index.node_of[action_to_explain]
+        explanation.extend(["D", name] for name in index.goal_chain(action_node))
+        # "U" Factor: User Preferences
+        explanation.append(["U", self.preferences])
+        return explanation
+
+    def explain_all(self, actions=None):
+        """{action: factor list} for the given actions, by default every ACT node of the trace."""
+        if actions is None:
+            actions = [self.tree.names[i] for i in self.nodes if self.tree.types[i] == ACT]
+        return {action: self.explain(action) for action in actions}
+
+
+@profiling.timed("generate_explanation")
+def generate_explanation(tree, trace, action_to_explain, norm, preferences, alt_trace=None, index=None):
+    """
+    Port of generate_explanation in assignment4.py, giving the same factor lists.
+    index is the TreeIndex of the tree (tree_index.py), looked up when not given.
+    To explain several actions of one trace, build an ExplanationContext once.
+    """
+    tree = as_compiled(tree)
+    if index is None:
+        index = tree_index(tree)
+    if action_to_explain not in index.node_of:
+        return []
+    return ExplanationContext(tree, trace, norm, preferences, alt_trace, index).explain(action_to_explain)
+
+
+def explain_annotated(tree, norm, beliefs, goal, preferences, action_to_explain, seed=None, strict=True):
+    """
+    The steps of run_pipeline after the annotation, on an annotated CompiledTree:
+    ([(selected names, cost)] or [], output). seed as in pick_lowest_cost_trace.
+    strict=False gives an empty output instead of assignment4's ValueError when
+    action_to_explain is not in the selected trace.
+    """
+    ranked = top_k_traces(tree, set(beliefs), goal, preferences, k=2)
+    if not len(ranked):
+        return [], []
+    selected, nonselected = ranked.selection(seed)
+    if not strict and action_to_explain not in selected[0][0]:
+        return selected, []
+    output = generate_explanation(tree, selected, action_to_explain, norm, preferences,
+                                  alt_trace=nonselected if nonselected else None,
+                                  index=tree_index(tree))
+    return selected, output
+
+
+@profiling.timed("run_pipeline")
+def run_pipeline(json_tree, norm, beliefs, goal, preferences, action_to_explain, seed=None):
+    """The module-level script of assignment4.py: returns (selected_trace, output)."""
+    tree = build_annotated_tree(json_tree, norm)
+    selected, output = explain_annotated(tree, norm, beliefs, goal, preferences, action_to_explain, seed)
+    if not selected:
+        return [], []
+    return selected[0][0], output
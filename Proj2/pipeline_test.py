@@ -0,0 +1,126 @@
+'''
+Checks of the pipeline.py trace searches against the exhaustive assignment4
+path (execution_trace + pick_lowest_cost_trace), run with the configured
+unittest discovery:
+
+    python -m unittest discover -s Proj2 -p "*test.py"
+'''
+
+import random
+import unittest
+
+from goal_tree import compile_tree
+from norms import NormAnnotator
+from pipeline import (build_annotated_tree, execution_trace, lowest_cost_trace, pick_lowest_cost_trace,
+                      top_k_traces, trace_costs)
+from selection import select
+from synthetic import synthetic_scenario, synthetic_tree
+from trace_cache import TraceCache
+
+
+def map_costs(data, fn):
+    """Apply fn to every cost of a tree JSON."""
+    if "costs" in data:
+        data["costs"] = [fn(c) for c in data["costs"]]
+    for child in data.get("children", []):
+        map_costs(child, fn)
+
+
+# synthetic costs are 0-5: kept, in tenths (their float sums depend on the order
+# they are added in), or cut to 0/1 so that many traces tie
+COSTS = (float, lambda c: c / 10, lambda c: float(c // 3))
+
+
+def searches(seed, trees=150):
+    """
+    Yield (annotated tree, beliefs, goal, goal_check, importance, tracelist) of
+    random scenarios with traces, over 1-3 cost dimensions, the COSTS variants
+    and priority orders that leave dimensions out.
+    """
+    rng = random.Random(seed)
+    for k in range(trees):
+        dims = rng.randint(1, 3)
+        data, props = synthetic_tree(depth=5, cost_dims=dims, seed=rng.randrange(1 << 30))
+        map_costs(data, COSTS[k % len(COSTS)])
+        tree = compile_tree(data)
+        for _ in range(4):
+            scenario = synthetic_scenario(data, props, seed=rng.randrange(1 << 30), cost_dims=dims,
+                                          belief_ratio=0.8)
+            annotated = build_annotated_tree(tree, scenario["norm"])
+            beliefs = set(scenario["beliefs"])
+            goal_check = rng.choice(("beliefs", "post"))
+            tracelist = execution_trace(annotated, beliefs, scenario["goal"], goal_check)
+            if tracelist:
+                importance = [scenario["preferences"][0], rng.sample(range(dims), rng.randint(1, dims))]
+                yield annotated, beliefs, scenario["goal"], goal_check, importance, tracelist
+
+
+def plain(traces):
+    """[(names, cost list)], comparable with assertEqual."""
+    return [(names, cost.tolist()) for names, cost in traces]
+
+
+def tied(tree, tracelist, importance):
+    """Number of traces tied on the lowest cost."""
+    return len(select(trace_costs(tree, tracelist), "lexicographic", importance[1])[1])
+
+
+class LowestCostTraceTest(unittest.TestCase):
+    """lowest_cost_trace selects the trace and cost of the exhaustive path, tie-break included."""
+
+    def test_same_selection(self):
+        rng = random.Random(1)
+        ties = 0
+        for tree, beliefs, goal, goal_check, importance, tracelist in searches(seed=0):
+            seed = rng.randrange(1000)
+            expected = pick_lowest_cost_trace(tree, tracelist, importance, seed=seed)[0]
+            result = lowest_cost_trace(tree, beliefs, goal, importance, goal_check, seed=seed)
+            self.assertEqual(plain(result), plain(expected))
+            ties += tied(tree, tracelist, importance) > 1
+        self.assertGreater(ties, 20, "too few ties to check the tie-break")
+
+
+
+class TopKTracesTest(unittest.TestCase):
+    """RankedTraces.selection is pick_lowest_cost_trace's selection, its non-selected list a prefix."""
+
+    def test_same_selection(self):
+        rng = random.Random(2)
+        ties = 0
+        for tree, beliefs, goal, goal_check, importance, tracelist in searches(seed=3):
+            seed, k = rng.randrange(1000), rng.randint(1, 3)
+            expected, expected_rest = pick_lowest_cost_trace(tree, tracelist, importance, seed=seed)
+            ranked = top_k_traces(tree, beliefs, goal, importance, k, goal_check)
+            self.assertGreaterEqual(len(ranked), min(k, len(tracelist)))
+            selected, rest = ranked.selection(seed)
+            self.assertEqual(plain(selected), plain(expected))
+            self.assertEqual(plain(rest), plain(expected_rest)[:len(rest)])
+            ties += tied(tree, tracelist, importance) > 1
+        self.assertGreater(ties, 20, "too few ties to check the tie-break")
+
+
+
+class TraceCacheTest(unittest.TestCase):
+    """One TraceCache across changing beliefs, goals and norms gives the uncached traces."""
+
+    def test_cached_traces(self):
+        rng = random.Random(4)
+        data, props = synthetic_tree(depth=5, seed=4)
+        annotator = NormAnnotator(compile_tree(data), {"type": "P", "actions": []})
+        names = sorted(set(annotator.tree.names))
+        cache = TraceCache(maxsize=256)
+        for step in range(300):
+            if step % 25 == 0:
+                annotator.update(added=rng.sample(names, 2))
+            tree = annotator.annotated()
+            beliefs = set(rng.sample(props, rng.randint(2, len(props))))
+            goal = rng.choice(props)
+            for goal_check in ("beliefs", "post"):
+                self.assertEqual(execution_trace(tree, beliefs, goal, goal_check, cache=cache),
+                                 execution_trace(tree, beliefs, goal, goal_check),
+                                 "step %d (%s)" % (step, goal_check))
+        self.assertTrue(cache.hits and cache.invalidated, "the cache was not exercised")
+
+
+if __name__ == "__main__":
+    unittest.main()
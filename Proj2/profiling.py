@@ -0,0 +1,186 @@
+'''
+Opt-in instrumentation of the trace/explanation pipeline.
+
+    with profiling.collect() as stats:
+        pipeline.run_pipeline(json_tree, norm, beliefs, goal, preferences, action)
+    print(stats.report())
+    stats.write_trace_events("run.json")  # open in chrome://tracing or Perfetto
+
+Stages are wall times per pipeline function (annotate, execution_trace,
+top_k_traces, pick_lowest_cost_trace, generate_explanation, ...). "expand" is
+the trace expansion inside them, so e.g. the self time of top_k_traces is
+its cost sorting. Counters:
+
+- nodes_visited: execution_trace steps (subtree expansions)
+- belief_copies: belief states handed to OR children, a set copy per child
+  in assignment3/4 (an int here)
+- traces_generated / traces_pruned: complete traces built, and OR branches or
+  candidate traces the top-k / branch-and-bound searches dropped unexpanded
+- cache_hits / cache_misses: trace_cache.TraceCache lookups
+- forest_nodes: nodes of the trace_forest.build_forest DAGs (nodes_visited
+  counts its distinct subtree expansions there)
+
+collect(cprofile=True) also runs cProfile over the block (write_cprofile).
+Without an active collect() every hook is a check of one thread-local
+attribute, so the instrumented functions cost about the same as before.
+Collection is per thread: collect() only sees the calls made by the thread
+that entered it, so concurrent requests (server.py) can each collect their
+own stats. parallel.py workers are not included.
+'''
+
+from contextlib import contextmanager, nullcontext
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+
+MAX_EVENTS = 100000
+
+_null_stage = nullcontext()
+
+
+class _Local(threading.local):
+    stats = None  # the Stats of this thread's innermost collect()
+
+
+_local = _Local()
+
+
+class Stats:
+    """Stage times, counters and trace events of one collect() block."""
+
+    def __init__(self, max_events=MAX_EVENTS):
+        self.stages = {}  # name -> [calls, seconds, self seconds]
+        self.counters = {}
+        self.events = []
+        self.max_events = max_events
+        self.events_dropped = 0
+        self.profiler = None
+        self._stacks = threading.local()
+        self._start = time.perf_counter()
+
+    @property
+    def _open(self):
+        """Child time of the stages currently running in this thread."""
+        stack = getattr(self._stacks, "open", None)
+        if stack is None:
+            stack = self._stacks.open = []
+        return stack
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def _record(self, name, started, seconds, child_seconds):
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += seconds - child_seconds
+        if len(self.events) < self.max_events:
+            self.events.append({"name": name, "ph": "X", "ts": (started - self._start) * 1e6,
+                                "dur": seconds * 1e6, "pid": os.getpid(), "tid": threading.get_ident()})
+        else:
+            self.events_dropped += 1
+
+    def as_dict(self):
+        return {
+            "stages": {name: {"calls": calls, "seconds": seconds, "self_seconds": own}
+                       for name, (calls, seconds, own) in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+    def report(self):
+        lines = ["%-24s %7s %11s %11s" % ("stage", "calls", "total ms", "self ms")]
+        for name, (calls, seconds, own) in sorted(self.stages.items(), key=lambda s: -s[1][1]):
+            lines.append("%-24s %7d %11.3f %11.3f" % (name, calls, seconds * 1e3, own * 1e3))
+        for name, value in sorted(self.counters.items()):
+            lines.append("%-24s %7d" % (name, value))
+        return "\n".join(lines)
+
+    def write_trace_events(self, path):
+        """Chrome trace-event JSON of the stages, with the counters as one counter event."""
+        end = (time.perf_counter() - self._start) * 1e6
+        events = self.events + [{"name": "counters", "ph": "C", "ts": end, "pid": os.getpid(),
+                                 "args": dict(self.counters)}]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "otherData": {"events_dropped": self.events_dropped}}, f)
+
+    def write_cprofile(self, path):
+        """pstats file of the cProfile run, needs collect(cprofile=True)."""
+        if self.profiler is None:
+            raise ValueError("collect(cprofile=True) was not used")
+        self.profiler.dump_stats(path)
+
+
+class _Stage:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.stack = self.stats._open
+        self.stack.append(0.0)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.started
+        child_seconds = self.stack.pop()
+        if self.stack:
+            self.stack[-1] += seconds
+        self.stats._record(self.name, self.started, seconds, child_seconds)
+        return False
+
+
+@contextmanager
+def collect(cprofile=False, max_events=MAX_EVENTS):
+    """Collect stats of the pipeline calls made inside the block, yields the Stats."""
+    previous = _local.stats
+    stats = _local.stats = Stats(max_events)
+    if cprofile:
+        stats.profiler = cProfile.Profile()
+        stats.profiler.enable()
+    try:
+        yield stats
+    finally:
+        if stats.profiler is not None:
+            stats.profiler.disable()
+        _local.stats = previous
+
+
+def active():
+    """The Stats being collected in this thread, or None."""
+    return _local.stats
+
+
+def stage(name):
+    """Context manager timing a stage, a shared no-op one when nothing is collected."""
+    stats = _local.stats
+    return _null_stage if stats is None else _Stage(stats, name)
+
+
+def count(name, n=1):
+    stats = _local.stats
+    if stats is not None:
+        stats.count(name, n)
+
+
+def timed(name):
+    """Decorator timing every call of a function as the stage name."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def timed_fn(*args, **kwargs):
+            stats = _local.stats
+            if stats is None:
+                return fn(*args, **kwargs)
+            with _Stage(stats, name):
+                return fn(*args, **kwargs)
+        return timed_fn
+    return wrap
@@ -0,0 +1,135 @@
+'''
+Streaming rendering, subtree hashes and structural diff of compiled trees.
+
+ex2_test.py checks an annotation by building the whole RenderTree string and
+comparing it line by line. render_lines() yields the same lines one at a time
+straight from the compiled arrays (no AnyNode tree, no joined string), and
+write_tree() streams them to a file.
+
+subtree_hashes() gives every node a Merkle hash: a digest of its own
+attributes (violation included) and of its children's hashes in order. Two
+trees with the same root hash render the same, so comparing against another
+tree or a stored golden hash is one comparison when they match, and diff()
+only walks down where the hashes differ.
+
+    with open("annotated.txt", "w") as f:
+        write_tree(tree, f)
+    tree_hash(tree) == golden
+    for a, b, what in diff(expected, tree):
+        print(what, expected.names[a] if a is not None else None)
+'''
+
+import hashlib
+
+from goal_tree import as_compiled, node_attributes
+
+# RenderTree's default ContStyle
+VERTICAL, CONT, END, BLANK = "│   ", "├── ", "└── ", "    "
+
+
+def node_repr(tree, i, clean=True):
+    """Node i as str() of its AnyNode prints it: AnyNode(key=value, ...) in key order."""
+    attrs = node_attributes(tree, i, clean)
+    return "AnyNode(" + ", ".join("%s=%r" % (key, attrs[key]) for key in sorted(attrs)) + ")"
+
+
+def render_lines(tree, root=0, node_text=None, clean=True):
+    """
+    Yield the lines of RenderTree(to_anytree(tree, root, clean)), one per node in
+    pre-order. node_text(tree, i) replaces the AnyNode repr, e.g. for a
+    by_attr-style rendering.
+    """
+    tree = as_compiled(tree)
+    end = tree.end.tolist()
+    parent = tree.parent.tolist()
+    depth = tree.depth.tolist()
+    text = node_text or (lambda tree, i: node_repr(tree, i, clean))
+    yield text(tree, root)
+    # indent[d]: what the levels above a node at depth root + d + 1 draw
+    indent = []
+    for i in range(root + 1, end[root]):
+        d = depth[i] - depth[root]
+        last = end[i] == end[parent[i]]
+        del indent[d - 1:]
+        yield "".join(indent) + (END if last else CONT) + text(tree, i)
+        indent.append(BLANK if last else VERTICAL)
+
+
+def write_tree(tree, stream, root=0, node_text=None, clean=True):
+    """Write render_lines() to a text stream, returns the number of lines."""
+    count = 0
+    for line in render_lines(tree, root, node_text, clean):
+        if count:
+            stream.write("\n")
+        stream.write(line)
+        count += 1
+    return count
+
+
+def violation_text(tree, i):
+    """ex2_test's render_tree_violations_only line of node i."""
+    violation = None if tree.violation is None else bool(tree.violation[i])
+    return "%s (Violation: %s)" % (tree.names[i], violation)
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def subtree_hashes(tree):
+    """
+    (own, subtree) digests per node: own hashes the node's attributes, subtree
+    its own digest and its children's subtree digests in order. Kept in
+    tree.annotation_cache, they change with the violation annotation.
+    """
+    tree = as_compiled(tree)
+    hashes = tree.annotation_cache.get("subtree_hashes")
+    if hashes is not None:
+        return hashes
+    n = len(tree)
+    own = [_digest(repr(sorted(node_attributes(tree, i).items())).encode()) for i in range(n)]
+    subtree = [None] * n
+    child_ptr, child_ids = tree.child_ptr.tolist(), tree.child_ids.tolist()
+    # children come after their parent in pre-order
+    for i in range(n - 1, -1, -1):
+        subtree[i] = _digest(own[i] + b"".join(subtree[c] for c in child_ids[child_ptr[i]:child_ptr[i + 1]]))
+    hashes = tree.annotation_cache["subtree_hashes"] = (own, subtree)
+    return hashes
+
+
+def tree_hash(tree, root=0):
+    """Hex Merkle hash of the subtree at root, to store as a golden value."""
+    return subtree_hashes(tree)[1][root].hex()
+
+
+def diff(a, b, limit=None):
+    """
+    Yield (node in a, node in b, what) for the smallest differing parts of two
+    trees, top-down. what is "changed" (the node's own attributes differ, its
+    children are still compared), "removed" (a subtree of a with no counterpart
+    in b, node in b is None) or "added" (the reverse). Children are paired by
+    position. Subtrees with equal hashes are skipped without being visited.
+    """
+    a, b = as_compiled(a), as_compiled(b)
+    own_a, subtree_a = subtree_hashes(a)
+    own_b, subtree_b = subtree_hashes(b)
+    count = 0
+    stack = [(0, 0)]
+    while stack:
+        i, j = stack.pop()
+        if i is None or j is None:
+            found = (i, j, "removed" if j is None else "added")
+        elif subtree_a[i] == subtree_b[j]:
+            continue
+        else:
+            kids_a, kids_b = a.children(i).tolist(), b.children(j).tolist()
+            pairs = [(kids_a[k] if k < len(kids_a) else None, kids_b[k] if k < len(kids_b) else None)
+                     for k in range(max(len(kids_a), len(kids_b)))]
+            stack.extend(reversed(pairs))
+            if own_a[i] == own_b[j]:
+                continue
+            found = (i, j, "changed")
+        yield found
+        count += 1
+        if limit is not None and count >= limit:
+            return
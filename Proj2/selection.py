@@ -0,0 +1,96 @@
+'''
+Vectorized trace selection over a (traces, dims) cost matrix.
+
+pick_lowest_cost_trace in assignment4.py sorts a dict of [quality, price, time]
+vectors with sorted() on the importance[1] priority tuple. Here the costs of
+all candidate traces are one NumPy matrix (pipeline.trace_costs, any number of
+cost dimensions) and each selection mode is a handful of array operations:
+
+- "lexicographic": compare on the priority order, first dimension first
+  (assignment4's rule)
+- "weighted": lowest costs @ weights
+- "pareto": the traces no other trace dominates (<= in every dimension of the
+  priority order and < in one), in lexicographic order
+
+rank() orders the rows best first, best_rows() gives the rows tied for the
+best selection; the pipeline picks among those with random.choice.
+'''
+
+import numpy as np
+
+MODES = ("lexicographic", "weighted", "pareto")
+
+
+def _priority(costs, priority_order):
+    return list(range(costs.shape[1])) if priority_order is None else list(priority_order)
+
+
+def lexicographic_order(costs, priority_order=None):
+    """Stable row order on the priority_order columns, like sorted() on the tuples."""
+    priority_order = _priority(costs, priority_order)
+    if not priority_order:
+        return np.arange(len(costs))
+    # lexsort sorts on the last key first
+    return np.lexsort([costs[:, i] for i in reversed(priority_order)])
+
+
+def weighted_scores(costs, weights):
+    if weights is None:
+        raise ValueError("weighted selection needs weights")
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.shape != (costs.shape[1],):
+        raise ValueError("need one weight per cost dimension (%d), got %s" % (costs.shape[1], weights.shape))
+    return costs @ weights
+
+
+def pareto_front(costs, priority_order=None):
+    """Bool mask of the non-dominated rows (lower is better), duplicates of a front row included."""
+    costs = np.asarray(costs)[:, _priority(costs, priority_order)]
+    keep = np.arange(len(costs))
+    remaining = costs
+    i = 0
+    while i < len(remaining):
+        # drop every row row i dominates, row i and its duplicates stay
+        undominated = (remaining < remaining[i]).any(axis=1) | (remaining == remaining[i]).all(axis=1)
+        keep, remaining = keep[undominated], remaining[undominated]
+        i = int(undominated[:i].sum()) + 1
+    front = np.zeros(len(costs), dtype=bool)
+    front[keep] = True
+    return front
+
+
+def rank(costs, mode="lexicographic", priority_order=None, weights=None):
+    """Row order, best first. Pareto puts the front first, both parts in lexicographic order."""
+    costs = np.asarray(costs)
+    if mode == "lexicographic":
+        return lexicographic_order(costs, priority_order)
+    if mode == "weighted":
+        return np.argsort(weighted_scores(costs, weights), kind="stable")
+    if mode == "pareto":
+        order = lexicographic_order(costs, priority_order)
+        front = pareto_front(costs, priority_order)[order]
+        return np.concatenate([order[front], order[~front]])
+    raise ValueError("unknown selection mode %r, use one of %s" % (mode, ", ".join(MODES)))
+
+
+def best_rows(costs, order, mode="lexicographic", priority_order=None, weights=None):
+    """
+    Rows tied for the selection, in row order: the rows with exactly the cost of
+    the first row in order (lexicographic, as in assignment4), the lowest score
+    (weighted) or the whole front (pareto).
+    """
+    costs = np.asarray(costs)
+    if not len(costs):
+        return []
+    if mode == "weighted":
+        scores = weighted_scores(costs, weights)
+        return np.flatnonzero(scores == scores[order[0]]).tolist()
+    if mode == "pareto":
+        return np.flatnonzero(pareto_front(costs, priority_order)).tolist()
+    return np.flatnonzero((costs == costs[order[0]]).all(axis=1)).tolist()
+
+
+def select(costs, mode="lexicographic", priority_order=None, weights=None):
+    """(order, best rows) of a cost matrix, see rank() and best_rows()."""
+    order = rank(costs, mode, priority_order, weights)
+    return order, best_rows(costs, order, mode, priority_order, weights)
@@ -0,0 +1,327 @@
+'''
+Long-running explanation service.
+
+The assignment scripts expect PrairieLearn to inject json_tree, norm, beliefs,
+goal and preferences as globals and recompute everything per run. This server
+keeps the work that does not change between runs: compiled trees sit in an
+LRU keyed by a hash of their content, annotated trees in a small LRU per tree
+keyed by the norm, and the belief/tree indexes live on the trees. Identical
+requests arriving while one is being computed wait for that result instead of
+computing it again.
+
+    python server.py --port 8000 --preload coffee.json
+
+    POST /trees    a goal tree JSON          -> {"tree_hash"}
+    POST /explain  {"json_tree" or "tree_hash", "norm", "beliefs", "goal",
+                    "preferences", "action_to_explain", optional "seed"}
+                   -> {"tree_hash", "selected_trace", "cost", "explanation"}
+    GET  /stats    cache and request counters
+
+Errors come back as {"error": message} with status 400 (bad request), 404
+(unknown tree_hash) or 500 (a failure in the server). Trees preloaded from a
+file are addressed by the tree_hash printed at start, a hash of the file's
+bytes. See loadtest.py for latency numbers.
+'''
+
+import argparse
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+
+import numpy as np
+
+from goal_tree import compile_tree
+from loader import content_hash, load_tree, parse_json
+from pipeline import build_annotated_tree, explain_annotated
+
+REQUEST_FIELDS = ("norm", "beliefs", "goal", "preferences", "action_to_explain")
+
+
+def canonical(value):
+    """Bytes of a JSON value that are the same for equal values, for hashing."""
+    return json.dumps(value, sort_keys=True, separators=(",", ":")).encode()
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError("%r is not JSON serializable" % type(value).__name__)
+
+
+class RequestError(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _is_names(value):
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def _check_fields(fields, seed, tree):
+    """Raise RequestError for /explain fields the pipeline cannot take."""
+    norm = fields["norm"]
+    if not (isinstance(norm, dict) and isinstance(norm.get("type"), str) and _is_names(norm.get("actions"))):
+        raise RequestError('norm must be {"type": str, "actions": [str]}')
+    if not _is_names(fields["beliefs"]):
+        raise RequestError("beliefs must be a list of strings")
+    for field in ("goal", "action_to_explain"):
+        if not isinstance(fields[field], str):
+            raise RequestError("%s must be a string" % field)
+    preferences = fields["preferences"]
+    if not (isinstance(preferences, list) and len(preferences) == 2 and isinstance(preferences[1], list)
+            and all(type(k) is int and 0 <= k < tree.dims for k in preferences[1])):
+        raise RequestError("preferences must be [labels, [cost indexes below %d]]" % tree.dims)
+    if seed is not None and type(seed) is not int:
+        raise RequestError("seed must be an integer")
+
+
+class LRU:
+    """Thread-safe bounded mapping, least recently used entries go first."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class Coalescer:
+    """Runs fn once per key at a time, concurrent callers with the same key share the result."""
+
+    def __init__(self):
+        self.coalesced = 0
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn):
+        with self._lock:
+            future = self._running.get(key)
+            owner = future is None
+            if owner:
+                future = self._running[key] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._running[key]
+        return future.result()
+
+
+class ExplanationService:
+    """The pipeline behind the server, usable without HTTP."""
+
+    def __init__(self, tree_cache_size=32, norm_cache_size=16):
+        self.trees = LRU(tree_cache_size)
+        self.norm_cache_size = norm_cache_size
+        self.in_flight = Coalescer()
+        self.requests = 0
+        self.errors = 0
+
+    def _tree_entry(self, data):
+        """(hash, cache entry) of a goal tree JSON dict, compiled once."""
+        if not isinstance(data, dict):
+            raise RequestError("a goal tree must be a JSON object")
+        tree_hash = content_hash(canonical(data))
+        entry = self.trees.get(tree_hash)
+        if entry is None:
+            def compile_entry():
+                try:
+                    tree = compile_tree(data)
+                except (KeyError, TypeError, ValueError) as e:
+                    raise RequestError("bad goal tree: %s: %s" % (type(e).__name__, e)) from e
+                entry = {"tree": tree, "annotated": LRU(self.norm_cache_size)}
+                self.trees.put(tree_hash, entry)
+                return entry
+            entry = self.in_flight.run(("tree", tree_hash), compile_entry)
+        return tree_hash, entry
+
+    def add_tree(self, data):
+        """Compile (unless cached) a goal tree JSON dict, returns its hash."""
+        return self._tree_entry(data)[0]
+
+    def add_tree_file(self, file_name):
+        """
+        Preload a goal tree file through loader.load_tree (and its binary cache).
+        The tree_hash is that of the file's bytes, the source hash the cache
+        keeps, so the JSON is not parsed when the cache is up to date.
+        """
+        with open(os.path.join(os.path.dirname(__file__), file_name), "rb") as f:
+            tree_hash = content_hash(f.read())
+        self.trees.put(tree_hash, {"tree": load_tree(file_name), "annotated": LRU(self.norm_cache_size)})
+        return tree_hash
+
+    def _annotated(self, entry, norm):
+        key = canonical(norm)
+        tree = entry["annotated"].get(key)
+        if tree is None:
+            tree = build_annotated_tree(entry["tree"], norm)
+            entry["annotated"].put(key, tree)
+        return tree
+
+    def explain(self, request):
+        """Answer one /explain request dict, see the module docstring."""
+        self.requests += 1
+        try:
+            return self._explain(request)
+        except Exception:
+            # RequestErrors are the client's, anything else is a server bug (500)
+            self.errors += 1
+            raise
+
+    def _explain(self, request):
+        if not isinstance(request, dict):
+            raise RequestError("the request must be a JSON object")
+        missing = [field for field in REQUEST_FIELDS if field not in request]
+        if missing:
+            raise RequestError("missing fields: " + ", ".join(missing))
+        if "json_tree" in request:
+            tree_hash, entry = self._tree_entry(request["json_tree"])
+        elif "tree_hash" in request:
+            tree_hash = request["tree_hash"]
+            if not isinstance(tree_hash, str):
+                raise RequestError("tree_hash must be a string")
+            entry = self.trees.get(tree_hash)
+            if entry is None:
+                raise RequestError("unknown tree_hash %r, send json_tree" % tree_hash, status=404)
+        else:
+            raise RequestError("send json_tree or the tree_hash of a tree posted to /trees")
+
+        fields = {field: request[field] for field in REQUEST_FIELDS}
+        seed = request.get("seed")
+        _check_fields(fields, seed, entry["tree"])
+        fields["beliefs"] = sorted(set(fields["beliefs"]))  # a set in the pipeline
+
+        def compute():
+            tree = self._annotated(entry, fields["norm"])
+            selected, output = explain_annotated(tree, fields["norm"], fields["beliefs"], fields["goal"],
+                                                 fields["preferences"], fields["action_to_explain"], seed,
+                                                 strict=False)
+            return {"tree_hash": tree_hash,
+                    "selected_trace": selected[0][0] if selected else [],
+                    "cost": selected[0][1].tolist() if selected else None,
+                    "explanation": output}
+
+        return self.in_flight.run(content_hash(canonical([tree_hash, fields, seed])), compute)
+
+    def stats(self):
+        return {"requests": self.requests, "errors": self.errors, "coalesced": self.in_flight.coalesced,
+                "trees": self.trees.stats()}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, load tests reuse connections
+    disable_nagle_algorithm = True  # headers and body are separate writes
+    service = None  # set by make_server
+    quiet = True
+
+    def _send(self, status, body):
+        data = json.dumps(body, default=_json_default).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self, data):
+        try:
+            return parse_json(data)
+        except ValueError as e:
+            raise RequestError("invalid JSON: %s" % e) from e
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send(200, self.service.stats())
+        else:
+            self._send(404, {"error": "unknown path %s" % self.path})
+
+    def do_POST(self):
+        # read the whole body first, on a kept-alive connection the next request follows it
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            if self.path == "/explain":
+                self._send(200, self.service.explain(self._body(body)))
+            elif self.path == "/trees":
+                self._send(200, {"tree_hash": self.service.add_tree(self._body(body))})
+            else:
+                self._send(404, {"error": "unknown path %s" % self.path})
+        except RequestError as e:
+            self._send(e.status, {"error": str(e)})
+        except Exception as e:
+            self._send(500, {"error": "%s: %s" % (type(e).__name__, e)})
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(host="127.0.0.1", port=8000, service=None, quiet=True):
+    """A ThreadingHTTPServer (one thread per connection) around an ExplanationService."""
+    handler = type("ServiceHandler", (Handler,), {"service": service or ExplanationService(), "quiet": quiet})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--tree-cache", type=int, default=32, help="compiled trees kept")
+    parser.add_argument("--norm-cache", type=int, default=16, help="annotated trees kept per tree")
+    parser.add_argument("--preload", action="append", default=[], help="goal tree file to compile at start")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    service = ExplanationService(args.tree_cache, args.norm_cache)
+    for file_name in args.preload:
+        print("%s: tree_hash %s" % (file_name, service.add_tree_file(file_name)))
+    server = make_server(args.host, args.port, service, quiet=not args.verbose)
+    print("serving on http://%s:%d" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
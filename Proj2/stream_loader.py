@@ -0,0 +1,255 @@
+'''
+Streaming goal-tree loader for JSON files too large to load whole.
+
+load_json_tree_locally reads the file into a dict and then builds the AnyNode
+tree, so the JSON text, the dict and the tree are all in memory at once.
+stream_tree reads the file in chunks, tokenizes it and fills a TreeBuilder
+node by node: a node's attributes are kept only until its JSON object closes,
+then they are interned into the compact arrays. The full dict never exists.
+
+With a norm the violation annotation is computed on the fly, with the rules of
+annotate_tree in ex2_test.py: ACT nodes from the norm, SEQ nodes if any child
+violates, OR nodes if all children do (any_types=(SEQ, AND) gives the rule
+pipeline.annotate uses by default).
+
+The tokenizer is pure Python, so this is slower than json.load; use it when
+memory is the limit. `python stream_loader.py [file]` reports peak memory.
+'''
+
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+from goal_tree import SEQ, TYPE_NAMES, TreeBuilder
+
+_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+_FLAT_ARRAY = r'\[(?:[^][{}"]|' + _STRING + r')*\]'
+_MEMBERS = r'(?:[^][{}"]|' + _STRING + '|' + _FLAT_ARRAY + r')*'
+# Most of a goal tree file is objects whose members are strings, numbers and
+# flat lists: a leaf node is one token, an inner node up to its children list
+# is one token ("head"). Everything else is read token by token.
+_TOKEN = re.compile(
+    r'[ \t\n\r]*(?:\{(?P<members>' + _MEMBERS + r')(?:(?P<leaf>\})|"children"[ \t\n\r]*:[ \t\n\r]*\[)'
+    r'|(?P<array>' + _FLAT_ARRAY + r')|(?P<punct>[][{}:,])|(?P<string>' + _STRING + r')'
+    r'|(?P<scalar>-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?|true|false|null))')
+_SPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_TAIL = ("", ".", "e", "E", "+", "-")
+_LITERALS = {"true": True, "false": False, "null": None}
+
+
+def _tokens(f, chunk_size):
+    """
+    (kind, value) tokens of a JSON text file: punctuation, ("s", str), ("v", value),
+    ("leaf", dict) for a whole object and ("head", dict) for an object up to and
+    including the '[' of its children list.
+    """
+    buf, pos, eof = f.read(chunk_size), 0, False
+    while True:
+        m = _TOKEN.match(buf, pos)
+        # a token may be cut by the end of the buffer: nothing matched, or a
+        # number that could go on in the next chunk
+        if not eof and (m is None or m.group("scalar") is not None
+                        and buf[m.end():m.end() + 1] in _NUMBER_TAIL):
+            chunk = f.read(chunk_size)
+            if chunk:
+                buf, pos = buf[pos:] + chunk, 0
+            else:
+                eof = True
+            continue
+        if m is None:
+            if _SPACE.match(buf, pos).end() == len(buf):
+                return
+            raise ValueError("invalid JSON near %r" % buf[pos:pos + 40])
+        pos = m.end()
+        members, leaf, array, punct, string, scalar = m.groups()
+        if members is not None:
+            if leaf is not None:
+                yield "leaf", json.loads("{" + members + "}")
+                continue
+            members = members.rstrip(" \t\n\r")
+            if members:
+                if not members.endswith(","):
+                    raise ValueError("expected ',' before 'children' in JSON")
+                members = members[:-1]
+            yield "head", json.loads("{" + members + "}")
+        elif punct is not None:
+            yield punct, None
+        elif string is not None:
+            yield "s", json.loads(string) if "\\" in string else string[1:-1]
+        elif array is not None:
+            yield "v", json.loads(array)
+        elif scalar in _LITERALS:
+            yield "v", _LITERALS[scalar]
+        else:
+            try:
+                yield "v", int(scalar)
+            except ValueError:
+                yield "v", float(scalar)
+
+
+def _take(tokens, expected=None):
+    try:
+        kind, value = next(tokens)
+    except StopIteration:
+        raise ValueError("unexpected end of JSON") from None
+    if expected is not None and kind != expected:
+        raise ValueError("expected %r in JSON, got %r" % (expected, value if kind in "sv" else kind))
+    return kind, value
+
+
+def _value(tokens, kind, value):
+    """Build an attribute value (list, dict or scalar) starting at the given token."""
+    if kind in ("s", "v", "leaf"):
+        return value
+    if kind == "[":
+        items = []
+        kind, value = _take(tokens)
+        while kind != "]":
+            items.append(_value(tokens, kind, value))
+            kind, value = _take(tokens)
+            if kind == ",":
+                kind, value = _take(tokens)
+        return items
+    if kind == "{":
+        return _members(tokens, {})
+    if kind == "head":
+        value["children"] = _value(tokens, "[", None)
+        return _members(tokens, value)
+    raise ValueError("unexpected %r in JSON" % kind)
+
+
+def _members(tokens, items):
+    """Read the remaining 'key: value' members of an object into items, up to its '}'."""
+    kind, key = _take(tokens)
+    while kind != "}":
+        if kind == ",":
+            kind, key = _take(tokens)
+        if kind != "s":
+            raise ValueError("expected an object key in JSON")
+        _take(tokens, ":")
+        items[key] = _value(tokens, *_take(tokens))
+        kind, key = _take(tokens)
+    return items
+
+
+def read_tree(f, norm=None, any_types=(SEQ,), chunk_size=1 << 16):
+    """
+    Build a CompiledTree from a goal tree JSON text file object. With a norm the
+    tree carries the violation annotation, without one any 'violation'
+    attributes in the file are kept.
+    """
+    tokens = _tokens(f, chunk_size)
+    builder = TreeBuilder()
+    violation = bytearray()
+    if norm is not None:
+        norm_type, actions = norm.get("type"), set(norm.get("actions", []))
+        any_names = {TYPE_NAMES[t] for t in any_types}
+
+    # one frame per open node: [node id, attributes, children, violating children]
+    stack = []
+
+    def close(i, attrs, n_children, n_violating):
+        builder.set_attrs(i, attrs)
+        if norm is not None:
+            node_type = attrs.get("type")
+            if node_type in any_names:
+                violation[i] = n_violating > 0
+            elif node_type == "OR":
+                violation[i] = n_violating == n_children
+            elif node_type == "ACT":
+                in_norm = attrs.get("name") in actions
+                violation[i] = in_norm if norm_type == "P" else norm_type == "O" and not in_norm
+        if stack:
+            stack[-1][2] += 1
+            stack[-1][3] += violation[i]
+
+    def start(kind, attrs):
+        """Open a node at a '{', head or leaf token; True if now in its children list."""
+        i = builder.add_node(stack[-1][0] if stack else -1, len(stack))
+        violation.append(0)
+        if kind == "leaf":
+            if attrs.get("children"):
+                raise ValueError("goal tree nodes must be objects")
+            close(i, attrs, 0, 0)
+            return bool(stack)  # back in the parent's children list
+        if kind not in ("{", "head"):
+            raise ValueError("goal tree nodes must be objects")
+        stack.append([i, attrs or {}, 0, 0])
+        return kind == "head"
+
+    in_children = start(*_take(tokens))
+    while stack:
+        frame = stack[-1]
+        kind, key = _take(tokens)
+        if kind == ",":
+            kind, key = _take(tokens)
+        if in_children:
+            if kind == "]":
+                in_children = False
+            else:
+                in_children = start(kind, key)
+            continue
+        if kind == "}":
+            close(*stack.pop())
+            in_children = bool(stack)
+            continue
+        if kind != "s":
+            raise ValueError("expected an object key in JSON")
+        _take(tokens, ":")
+        kind, value = _take(tokens)
+        if key == "children":
+            if kind == "[":
+                in_children = True
+            elif not (kind == "v" and value == []):
+                raise ValueError("goal tree children must be a list")
+        else:
+            frame[1][key] = _value(tokens, kind, value)
+    for _ in tokens:
+        raise ValueError("extra data after the goal tree in JSON")
+
+    return builder.finish(violation=violation if norm is not None else None)
+
+
+def stream_tree(file_name="coffee.json", norm=None, any_types=(SEQ,), chunk_size=1 << 16):
+    """read_tree on a file, relative paths are taken from this directory."""
+    path = os.path.join(os.path.dirname(__file__), file_name)
+    with open(path, encoding="utf-8") as f:
+        return read_tree(f, norm, any_types, chunk_size)
+
+
+def _peak(load):
+    tracemalloc.start()
+    started = time.perf_counter()
+    tree = load()
+    seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return tree, seconds, peak
+
+
+if __name__ == "__main__":
+    from anytree.importer import DictImporter
+
+    from goal_tree import compile_tree
+
+    file_name = sys.argv[1] if len(sys.argv) > 1 else "coffee.json"
+    path = os.path.join(os.path.dirname(__file__), file_name)
+    norm = {"type": "P", "actions": []}
+
+    def dict_anynode():
+        with open(path) as f:
+            return DictImporter().import_(json.load(f))
+
+    def dict_compiled():
+        with open(path) as f:
+            return compile_tree(json.load(f))
+
+    print("%s, %.1f MB" % (file_name, os.path.getsize(path) / 1e6))
+    for label, load in [("json.load + DictImporter", dict_anynode),
+                        ("json.load + compile_tree", dict_compiled),
+                        ("stream_tree", lambda: stream_tree(path, norm))]:
+        tree, seconds, peak = _peak(load)
+        print("%-26s peak %8.1f MB  %6.2f s" % (label, peak / 1e6, seconds))
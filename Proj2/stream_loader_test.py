@@ -0,0 +1,53 @@
+'''
+Checks of stream_loader.read_tree, run with the configured unittest discovery:
+
+    python -m unittest discover -s Proj2 -p "*test.py"
+'''
+
+import io
+import json
+import os
+import random
+import unittest
+
+from goal_tree import SEQ, compile_tree
+from pipeline import build_annotated_tree
+from render import tree_hash
+from stream_loader import read_tree
+from synthetic import synthetic_tree
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def shuffled(node, rng):
+    """A copy of a tree JSON with the keys of every node in random order."""
+    items = [(key, [shuffled(child, rng) for child in value] if key == "children" else value)
+             for key, value in node.items()]
+    rng.shuffle(items)
+    return dict(items)
+
+
+class ReadTreeTest(unittest.TestCase):
+    """read_tree builds the tree of json.load + compile_tree for any key order, string escapes and chunk size."""
+
+    def test_same_tree(self):
+        rng = random.Random(0)
+        with open(os.path.join(HERE, "coffee.json"), encoding="utf-8") as f:
+            coffee = json.load(f)
+        trees = [(coffee, {"type": "P", "actions": ["gotoKitchen"]}),
+                 (synthetic_tree(depth=4, seed=5)[0], {"type": "O", "actions": ["n5", "n7", "n12"]})]
+        for data, norm in trees:
+            data = dict(data, note='a "quoted" \\ back\tslash, café ☃ {[,:]}')
+            for ensure_ascii, indent in ((True, None), (False, 2)):
+                text = json.dumps(shuffled(data, rng), ensure_ascii=ensure_ascii, indent=indent)
+                expected = tree_hash(compile_tree(json.loads(text)))
+                annotated = tree_hash(build_annotated_tree(compile_tree(json.loads(text)), norm, any_types=(SEQ,)))
+                for chunk_size in (1, 2, 3, 7, 64, 4096, 1 << 16):
+                    self.assertEqual(tree_hash(read_tree(io.StringIO(text), chunk_size=chunk_size)), expected,
+                                     "chunk size %d" % chunk_size)
+                    self.assertEqual(tree_hash(read_tree(io.StringIO(text), norm, (SEQ,), chunk_size)), annotated,
+                                     "annotated, chunk size %d" % chunk_size)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+'''
+Synthetic goal trees for benchmarks and equivalence checks.
+
+synthetic_tree() builds a random tree in the coffee.json schema with a given
+depth, fan-out per node type, precondition/postcondition/link density and
+number of cost dimensions. synthetic_scenario() picks the PrairieLearn
+globals of assignment4.py (norm, beliefs, goal, preferences, action) for it.
+Both are deterministic for a given seed.
+
+Links only point to ACT nodes later in pre-order, so every link chain ends at
+a node without links, which the L-factor loop of assignment4.py relies on.
+'''
+
+import random
+
+DEFAULT_FAN_OUT = {"OR": 3, "SEQ": 3, "AND": 2}
+
+
+def synthetic_tree(depth=6, fan_out=None, leaf_prob=0.15, pre_density=0.4, post_density=0.8,
+                   link_density=0.2, n_props=12, cost_dims=3, root_type="OR", seed=0):
+    """
+    Random goal tree as a JSON dict, and the list of belief propositions it uses.
+    fan_out maps "OR"/"SEQ"/"AND" to the number of children of such nodes,
+    inner node types are drawn uniformly from the types with a fan-out. Nodes
+    above depth become ACT leaves with probability leaf_prob (never the root),
+    all nodes at depth are ACT leaves. The root is a root_type node, like the
+    OR root of coffee.json (None: drawn like the others).
+    """
+    rng = random.Random(seed)
+    fan_out = DEFAULT_FAN_OUT if fan_out is None else fan_out
+    inner_types = [t for t in fan_out if fan_out[t] > 0]
+    props = ["p%d" % i for i in range(n_props)]
+    acts = []
+    counter = [0]
+
+    def node(level):
+        counter[0] += 1
+        name = "n%d" % counter[0]
+        if level == depth or not inner_types or level and rng.random() < leaf_prob:
+            data = {"name": name, "type": "ACT",
+                    "costs": [float(rng.randint(0, 5)) for _ in range(cost_dims)]}
+            if rng.random() < pre_density:
+                data["pre"] = rng.sample(props, rng.randint(1, min(2, n_props)))
+            if rng.random() < post_density:
+                data["post"] = rng.sample(props, 1)
+            acts.append(data)
+            return data
+        node_type = root_type if level == 0 and root_type else rng.choice(inner_types)
+        data = {"name": name, "type": node_type}
+        if rng.random() < pre_density / 2:
+            data["pre"] = rng.sample(props, 1)
+        data["children"] = [node(level + 1) for _ in range(fan_out.get(node_type, 2))]
+        if node_type != "OR":
+            for k, child in enumerate(data["children"]):
+                child["sequence"] = k + 1
+        return data
+
+    root = node(0)
+    for k, act in enumerate(acts[:-1]):
+        if rng.random() < link_density:
+            target = acts[rng.randint(k + 1, len(acts) - 1)]
+            act["link"] = [target["name"]]
+            target.setdefault("slink", []).append(act["name"])
+    return root, props
+
+
+def synthetic_scenario(tree, props, seed=0, cost_dims=3, belief_ratio=0.5):
+    """
+    The assignment4 globals for one run on a synthetic tree, as a dict. The
+    beliefs are a random belief_ratio share of the propositions.
+    """
+    rng = random.Random(seed)
+    acts, stack = [], [tree]
+    while stack:
+        data = stack.pop()
+        if data["type"] == "ACT":
+            acts.append(data["name"])
+        stack.extend(reversed(data.get("children", [])))
+    labels = (["quality", "price", "time"] + ["cost%d" % d for d in range(3, cost_dims)])[:cost_dims]
+    return {
+        # obligations block most of a random tree, so they are the rarer norm
+        "norm": {"type": "O" if rng.random() < 0.2 else "P", "actions": rng.sample(acts, min(len(acts), 3))},
+        "beliefs": rng.sample(props, round(len(props) * belief_ratio)),
+        "goal": rng.choice(props),
+        "preferences": [labels, rng.sample(range(cost_dims), cost_dims)],
+        "action_to_explain": rng.choice(acts),
+    }
@@ -0,0 +1,82 @@
+'''
+Bounded memo cache for execution_trace subtree results.
+
+The traces of a subtree only depend on the node, the annotation and the part
+of the beliefs that some precondition inside the subtree looks at. TraceCache
+stores, per (node id, projected beliefs, goal), the subtree's first trace (the
+only one an enclosing SEQ or OR walk uses) and the post mask it adds to the
+beliefs of an enclosing SEQ.
+
+Pass one cache to several execution_trace / top_k_traces / lowest_cost_trace
+calls on the same tree. When the annotation changes (a new norm, see
+norms.NormAnnotator) only entries for nodes whose subtree contains a changed
+node are dropped; a different tree clears everything.
+'''
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class TraceCache:
+    """LRU of subtree trace results with hit/miss counters."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self._entries = OrderedDict()
+        self._structure = None  # the names list identifies the tree the entries belong to
+        self._end = None
+        self._violation = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "invalidated": self.invalidated}
+
+    def clear(self):
+        self._entries.clear()
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def sync(self, tree, violation):
+        """Bind to a tree and annotation, dropping the entries they make stale."""
+        violation = np.zeros(len(tree), dtype=bool) if violation is None else np.asarray(violation)
+        if self._structure is not tree.names:
+            self.clear()
+            self._structure, self._end = tree.names, tree.end
+        elif self._violation is not None:
+            changed = np.flatnonzero(self._violation != violation)
+            if len(changed):
+                self.invalidate(changed)
+        self._violation = violation.copy()
+
+    def invalidate(self, changed):
+        """Drop entries of nodes that are changed nodes or have one in their subtree."""
+        changed = np.sort(np.asarray(changed))
+        stale = []
+        for key in self._entries:
+            node = key[0]
+            # pre-order ids: the subtree of node is [node, end[node])
+            at = np.searchsorted(changed, node)
+            if at < len(changed) and changed[at] < self._end[node]:
+                stale.append(key)
+        for key in stale:
+            del self._entries[key]
+        self.invalidated += len(stale)
@@ -0,0 +1,288 @@
+'''
+Exact execution traces as a shared trace forest.
+
+execution_trace in assignment3/4 keeps only child_traces[0] under SEQ/AND, so
+every OR choice below a sequence but the first is lost. build_forest explores
+all of them. Beliefs are threaded through each sequence step: every ACT a
+trace executes adds its post to the beliefs the following steps see (the
+assignments only add the post of the step's last node).
+
+The number of traces grows with the product of the OR fan-outs, so they are
+not built. A subtree's traces only depend on the node and the beliefs its
+preconditions read, and they differ only in the beliefs they leave behind, so
+the forest is a DAG of three kinds of nodes:
+
+  LEAF  one tree node, the trace [i]
+  CAT   every trace of a followed by every trace of b
+  ALT   the traces of each child, in child order
+
+with one shared ALT per (tree node, projected beliefs, beliefs added). On the
+DAG count() is a sum/product pass, best() a min/sum pass with back pointers,
+and traces() enumerates lazily.
+
+    forest = build_forest(tree, set(beliefs), goal)
+    forest.count()
+    forest.best(preferences)   # [(names, cost)], like pick_lowest_cost_trace's selection
+'''
+
+from fractions import Fraction
+
+from beliefs import belief_index
+from goal_index import goal_index
+from goal_tree import ACT, SEQ, AND, OR, as_compiled, derived, make_rng
+from pipeline import act_cost_rows, trace_costs, trace_names
+import profiling
+from selection import MODES
+
+LEAF, CAT, ALT = 0, 1, 2
+
+
+class TraceForest:
+    """
+    DAG of forest nodes: kinds[k] is LEAF/CAT/ALT, for a LEAF left[k] is the tree
+    node id, for a CAT left/right are the two parts, for an ALT left is a tuple
+    of alternatives. Parts always come before the node using them. root is the
+    forest node of all traces from the tree root, None if there is no trace.
+    """
+
+    def __init__(self, tree, kinds, left, right, root):
+        self.tree = tree
+        self.kinds = kinds
+        self.left = left
+        self.right = right
+        self.root = root
+        self._counts = None
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def counts(self):
+        """Number of traces per forest node (Python ints, they do not overflow)."""
+        if self._counts is None:
+            counts = []
+            for kind, a, b in zip(self.kinds, self.left, self.right):
+                if kind == LEAF:
+                    counts.append(1)
+                elif kind == CAT:
+                    counts.append(counts[a] * counts[b])
+                else:
+                    counts.append(sum(counts[c] for c in a))
+            self._counts = counts
+        return self._counts
+
+    def count(self):
+        """Number of distinct execution traces from the root."""
+        return 0 if self.root is None else self.counts()[self.root]
+
+    def traces(self, limit=None):
+        """Yield the traces as lists of node ids, depth-first without building the rest."""
+        if self.root is None or limit is not None and limit <= 0:
+            return
+        kinds, left, right = self.kinds, self.left, self.right
+        count = 0
+        # (trace so far, agenda): the agenda is a linked list (forest node, rest)
+        stack = [((), (self.root, None))]
+        while stack:
+            trace, agenda = stack.pop()
+            while agenda is not None:
+                k, agenda = agenda
+                kind = kinds[k]
+                if kind == LEAF:
+                    trace += (left[k],)
+                elif kind == CAT:
+                    agenda = (left[k], (right[k], agenda))
+                else:
+                    for alt in reversed(left[k][1:]):
+                        stack.append((trace, (alt, agenda)))
+                    agenda = (left[k][0], agenda)
+            yield list(trace)
+            count += 1
+            if limit is not None and count >= limit:
+                return
+
+    def _keys(self, importance, mode, weights):
+        """
+        Per tree node, the selection key of its own cost with exact values (ints,
+        or Fractions for non-integral costs/weights): the cost vector with the
+        importance[1] dimensions first, or the weighted score.
+        """
+        rows = derived(self.tree, "exact_cost_rows", _exact_cost_rows)
+        dims = self.tree.dims
+        if mode == "lexicographic":
+            priority = list(importance[1])
+            order = priority + [d for d in range(dims) if d not in priority]
+            return [tuple(row[d] for d in order) for row in rows]
+        if mode == "weighted":
+            if weights is None or len(weights) != dims:
+                raise ValueError("weighted selection needs one weight per cost dimension (%d)" % dims)
+            weights = [_exact(w) for w in weights]
+            return [(sum(c * w for c, w in zip(row, weights)),) for row in rows]
+        raise ValueError("a trace forest selects with %s, not %r"
+                         % (" or ".join(m for m in MODES if m != "pareto"), mode))
+
+    def best(self, importance, mode="lexicographic", weights=None, seed=None):
+        """
+        The lowest cost trace as [(names, cost)], or [] when there is none. Costs add
+        up along a trace, so a CAT's best key is the sum of its parts' and an
+        ALT's the smallest of its alternatives'. mode is "lexicographic" or
+        "weighted".
+
+        Tie rule: in lexicographic mode the key is the whole cost vector, the
+        importance[1] dimensions first and then the others in index order, and
+        traces tie when their cost vectors are equal (pick_lowest_cost_trace's
+        test). In weighted mode they tie on equal scores. Sums are exact, so
+        ties do not depend on the order costs are added in. Tied traces are
+        picked uniformly (random.Random(seed) when a seed is given). This is
+        pick_lowest_cost_trace's selection over all exact traces, except that
+        when importance[1] leaves dimensions out, pick_lowest_cost_trace takes
+        the first best trace in enumeration order as the cost to tie with, and
+        here it is the lowest on the left-out dimensions. With non-integral
+        costs its float sums can also miss ties that are exact here.
+        """
+        if self.root is None:
+            return []
+        node_keys = self._keys(importance, mode, weights)
+        kinds, left, right = self.kinds, self.left, self.right
+        keys, ties = [], []  # best key and the number of traces with it, per forest node
+        for kind, a, b in zip(kinds, left, right):
+            if kind == LEAF:
+                keys.append(node_keys[a])
+                ties.append(1)
+            elif kind == CAT:
+                keys.append(tuple(x + y for x, y in zip(keys[a], keys[b])))
+                ties.append(ties[a] * ties[b])
+            else:
+                best_key = min(keys[c] for c in a)
+                keys.append(best_key)
+                ties.append(sum(ties[c] for c in a if keys[c] == best_key))
+
+        rng = make_rng(seed)
+        trace, agenda = [], [self.root]
+        while agenda:
+            k = agenda.pop()
+            kind = kinds[k]
+            if kind == LEAF:
+                trace.append(left[k])
+            elif kind == CAT:
+                agenda.extend((right[k], left[k]))
+            else:
+                # an alternative with probability (its tied traces) / (all tied traces)
+                pick = rng.randrange(ties[k]) if ties[k] > 1 else 0
+                for c in left[k]:
+                    if keys[c] == keys[k]:
+                        if pick < ties[c]:
+                            agenda.append(c)
+                            break
+                        pick -= ties[c]
+        return [(trace_names(self.tree, trace), trace_costs(self.tree, [trace])[0])]
+
+
+def _exact(value):
+    return int(value) if float(value).is_integer() else Fraction(value)
+
+
+def _exact_cost_rows(tree):
+    """ACT cost rows as lists of ints/Fractions, sums of them do not round."""
+    return [[_exact(c) for c in row] for row in act_cost_rows(tree).tolist()]
+
+
+@profiling.timed("build_forest")
+def build_forest(tree, beliefs, goal, goal_check="beliefs"):
+    """
+    TraceForest of all execution traces from the root, exploring every combination
+    under SEQ/AND. goal_check is the ACT rule as in pipeline.execution_trace. AND
+    is handled like SEQ, both in child order.
+    """
+    tree = as_compiled(tree)
+    index = belief_index(tree)
+    unknown = {}
+    belief_mask = index.encode(beliefs, unknown)
+    pre_mask, post_mask = index.pre_mask, index.post_mask
+    relevant = index.relevant_masks()
+    if goal_check == "post":
+        goal_bit = index.bit_of.get(goal)
+        goal_mask = 1 << goal_bit if goal_bit is not None else 0
+    elif isinstance(goal, (set, frozenset)):
+        goal_mask = index.encode(goal, unknown)
+        relevant = None  # the goal is compared with the whole belief set
+    else:
+        goal_mask = None
+    violation = tree.violation
+    types = tree.types
+    post_present = tree.present["post"]
+    required = goal_index(tree).required(goal_check, goal)
+
+    kinds, left, right = [], [], []
+    leaves = {}
+
+    def add(kind, a, b=None):
+        kinds.append(kind)
+        left.append(a)
+        right.append(b)
+        return len(kinds) - 1
+
+    def leaf(i):
+        k = leaves.get(i)
+        if k is None:
+            k = leaves[i] = add(LEAF, i)
+        return k
+
+    def alt(alternatives):
+        return alternatives[0] if len(alternatives) == 1 else add(ALT, tuple(alternatives))
+
+    memo = {}
+
+    def outcomes(i, beliefs):
+        """[(beliefs added, forest node)] of the subtree at i, one entry per distinct addition."""
+        key = (i, beliefs if relevant is None else beliefs & relevant[i])
+        result = memo.get(key)
+        if result is not None:
+            return result
+        profiling.count("nodes_visited")
+        result = []
+        blocked = violation is not None and violation[i] or required[i] & beliefs != required[i]
+        node_type = None if blocked else types[i]
+        if node_type == ACT:
+            if goal_check == "post":
+                reached = post_mask[i] & goal_mask != 0
+            else:
+                reached = post_present[i] and beliefs == goal_mask
+            if reached or pre_mask[i] & beliefs == pre_mask[i]:
+                result = [(post_mask[i], leaf(i))]
+        elif node_type == OR:
+            grouped = {}
+            for child in tree.children(i).tolist():
+                for added, k in outcomes(child, beliefs):
+                    grouped.setdefault(added, []).append(k)
+            result = [(added, add(CAT, leaf(i), alt(ks))) for added, ks in grouped.items()]
+        elif node_type in (SEQ, AND):
+            # partial sequences grouped by what they added so far
+            states = [(0, None)]
+            for child in tree.children(i).tolist():
+                grouped = {}
+                for added, k in states:
+                    for child_added, child_k in outcomes(child, beliefs | added):
+                        part = child_k if k is None else add(CAT, k, child_k)
+                        grouped.setdefault(added | child_added, []).append(part)
+                states = [(added, alt(ks)) for added, ks in grouped.items()]
+                if not states:
+                    break
+            result = [(added, leaf(i) if k is None else add(CAT, leaf(i), k)) for added, k in states]
+        memo[key] = result
+        return result
+
+    roots = [k for _, k in outcomes(0, belief_mask)]
+    forest = TraceForest(tree, kinds, left, right, alt(roots) if roots else None)
+    profiling.count("forest_nodes", len(forest))
+    return forest
+
+
+def exact_traces(tree, beliefs, goal, goal_check="beliefs", limit=None):
+    """The forest's traces as a list, the exact counterpart of pipeline.execution_trace."""
+    return list(build_forest(tree, beliefs, goal, goal_check).traces(limit))
+
+
+def exact_lowest_cost_trace(tree, beliefs, goal, importance, goal_check="beliefs", seed=None,
+                            mode="lexicographic", weights=None):
+    """The selected part of pick_lowest_cost_trace over all exact traces, without building them."""
+    return build_forest(tree, beliefs, goal, goal_check).best(importance, mode, weights, seed)
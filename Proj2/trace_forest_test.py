@@ -0,0 +1,132 @@
+'''
+Checks of trace_forest.build_forest against a brute-force enumeration of the
+exact traces, run with the configured unittest discovery:
+
+    python -m unittest discover -s Proj2 -p "*test.py"
+'''
+
+from fractions import Fraction
+import random
+import unittest
+
+from goal_tree import ACT, SEQ, AND, OR, compile_tree
+from pipeline import build_annotated_tree, trace_costs, trace_names
+from pipeline_test import COSTS, map_costs
+from synthetic import synthetic_scenario, synthetic_tree
+from trace_forest import build_forest
+
+MAX_TRACES = 3000  # scenarios with more exact traces are skipped, the enumeration below builds them all
+
+
+def brute_force(tree, beliefs, goal, goal_check):
+    """
+    Every exact trace as (node ids, beliefs added) by plain recursion: every OR
+    child, every combination of child traces under SEQ/AND, each step seeing
+    the posts of all ACTs before it.
+    """
+    def run(i, beliefs):
+        if tree.violation is not None and tree.violation[i]:
+            return []
+        node_type = tree.types[i]
+        if node_type == ACT:
+            post = frozenset(tree.strings("post", i))
+            if goal_check == "post":
+                reached = goal in post
+            else:
+                reached = bool(tree.present["post"][i]) and beliefs == goal
+            if reached or set(tree.strings("pre", i)) <= beliefs:
+                return [([i], post)]
+            return []
+        if node_type == OR:
+            return [([i] + trace, added) for child in tree.children(i).tolist()
+                    for trace, added in run(child, beliefs)]
+        if node_type in (SEQ, AND):
+            states = [([], frozenset())]
+            for child in tree.children(i).tolist():
+                states = [(trace + child_trace, added | child_added) for trace, added in states
+                          for child_trace, child_added in run(child, beliefs | added)]
+            return [([i] + trace, added) for trace, added in states]
+        return []
+
+    return [trace for trace, _ in run(0, frozenset(beliefs))]
+
+
+def exact_key(tree, trace, importance, mode, weights):
+    """The selection key of a trace from exact (Fraction) sums of its ACT costs."""
+    cost = [sum((Fraction(tree.costs[i][d]) for i in trace if tree.types[i] == ACT), Fraction(0))
+            for d in range(tree.dims)]
+    if mode == "weighted":
+        return (sum(c * Fraction(w) for c, w in zip(cost, weights)),)
+    order = list(importance[1]) + [d for d in range(tree.dims) if d not in importance[1]]
+    return tuple(cost[d] for d in order)
+
+
+def forests(seed, trees=60):
+    """
+    Yield (annotated tree, beliefs, goal, goal_check, importance) of random
+    scenarios with at most MAX_TRACES exact traces. Goals are sometimes belief
+    sets, so ACTs are also reached as the goal in "beliefs" mode.
+    """
+    rng = random.Random(seed)
+    for k in range(trees):
+        dims = rng.randint(1, 3)
+        data, props = synthetic_tree(depth=rng.choice((4, 5)), cost_dims=dims, seed=rng.randrange(1 << 30))
+        map_costs(data, COSTS[k % len(COSTS)])
+        tree = compile_tree(data)
+        for _ in range(3):
+            scenario = synthetic_scenario(data, props, seed=rng.randrange(1 << 30), cost_dims=dims,
+                                          belief_ratio=rng.choice((0.5, 0.8, 1.0)))
+            annotated = build_annotated_tree(tree, scenario["norm"])
+            beliefs = set(scenario["beliefs"])
+            goal_check = rng.choice(("beliefs", "post"))
+            goal = scenario["goal"]
+            if goal_check == "beliefs" and rng.random() < 0.3:
+                goal = frozenset(beliefs | {goal})
+            if build_forest(annotated, beliefs, goal, goal_check).count() <= MAX_TRACES:
+                importance = [scenario["preferences"][0], rng.sample(range(dims), rng.randint(1, dims))]
+                yield annotated, beliefs, goal, goal_check, importance
+
+
+class TraceForestTest(unittest.TestCase):
+    """count(), traces() and best() agree with the brute-force enumeration."""
+
+    def test_traces(self):
+        total = 0
+        for tree, beliefs, goal, goal_check, _ in forests(seed=0):
+            expected = sorted(brute_force(tree, beliefs, goal, goal_check))
+            forest = build_forest(tree, beliefs, goal, goal_check)
+            self.assertEqual(forest.count(), len(expected))
+            self.assertEqual(sorted(forest.traces()), expected)
+            total += len(expected)
+        self.assertGreater(total, 1000)
+
+    def test_best(self):
+        rng = random.Random(1)
+        ties = 0
+        for tree, beliefs, goal, goal_check, importance in forests(seed=2):
+            traces = brute_force(tree, beliefs, goal, goal_check)
+            forest = build_forest(tree, beliefs, goal, goal_check)
+            if not traces:
+                self.assertEqual(forest.best(importance), [])
+                continue
+            mode = rng.choice(("lexicographic", "weighted"))
+            weights = [rng.choice((1, 2, 0.5, 0.1)) for _ in range(tree.dims)] if mode == "weighted" else None
+            keys = [exact_key(tree, trace, importance, mode, weights) for trace in traces]
+            best_key = min(keys)
+            tied = {tuple(trace_names(tree, trace)) for trace, key in zip(traces, keys) if key == best_key}
+            picked = set()
+            for seed in range(40 if len(tied) > 1 else 1):
+                [(names, cost)] = forest.best(importance, mode, weights, seed)
+                self.assertIn(tuple(names), tied)
+                trace = [tree.name_to_id[name] for name in names]
+                self.assertEqual(cost.tolist(), trace_costs(tree, [trace])[0].tolist())
+                picked.add(tuple(names))
+            if len(tied) > 1:
+                ties += 1
+                if len(tied) <= 4:
+                    self.assertEqual(picked, tied, "a tied trace is never picked")
+        self.assertGreater(ties, 20, "too few ties to check the tie rule")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+'''
+Lazy trace enumeration.
+
+get_traces in ex1.py builds every trace up front with a cartesian product per
+SEQ/AND node. iter_traces walks the same choices depth-first and yields one
+trace at a time, in the same order. All traces share one path list (the common
+prefix is never copied), only the yielded trace is a new list. When every
+trace is wanted anyway, all_traces builds them bottom-up like ex1.py does, which
+is faster than walking trace by trace.
+
+TraceArray keeps many traces as one int32 array of node ids plus offsets, 4
+bytes per trace step instead of a list of Python ints per trace; names are
+looked up only when a trace is printed.
+'''
+
+from array import array
+
+import numpy as np
+
+from goal_tree import ACT, SEQ, AND, OR, as_compiled
+
+
+class TraceArray:
+    """
+    Traces of one tree in CSR form: trace k is ids[offsets[k]:offsets[k + 1]].
+    Indexing gives a list of node ids, like an entry of execution_trace's list,
+    so a TraceArray can stand in for that list (pick_lowest_cost_trace, trace_costs).
+    """
+
+    def __init__(self, tree, ids, offsets):
+        self.tree = tree
+        self.ids = ids          # int32 node ids of all traces, back to back
+        self.offsets = offsets  # int64, len(traces) + 1
+
+    @classmethod
+    def build(cls, tree, traces):
+        """From an iterable of id sequences, without keeping the sequences."""
+        ids, offsets = array("i"), array("q", [0])
+        for trace in traces:
+            ids.extend(trace)
+            offsets.append(len(ids))
+        return cls(tree, np.frombuffer(ids, dtype=np.int32), np.frombuffer(offsets, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("trace index out of range")
+        return self.ids[self.offsets[k]:self.offsets[k + 1]].tolist()
+
+    def __iter__(self):
+        ids, offsets = self.ids.tolist(), self.offsets.tolist()
+        for k in range(len(self)):
+            yield ids[offsets[k]:offsets[k + 1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def names(self, k):
+        names = self.tree.names
+        return [names[i] for i in self[k]]
+
+    def name_lists(self):
+        names = self.tree.names
+        return [[names[i] for i in trace] for trace in self]
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.offsets.nbytes
+
+
+def all_traces(tree, node=0):
+    """Every trace of the subtree at node id node as a list of names, in get_traces order."""
+    tree = as_compiled(tree)
+    types, node_names = tree.types.tolist(), tree.names
+    traces = {}
+    # children come after their parent in pre-order; child traces are only used
+    # once, so they are extended in place
+    for i in range(int(tree.end[node]) - 1, node - 1, -1):
+        node_type = types[i]
+        if node_type == ACT:
+            own = [[]]
+        elif node_type in (SEQ, AND):
+            own = [[]]
+            for child in tree.ordered_children(i):
+                child_traces = traces.pop(child)
+                own = [prefix + trace for prefix in own for trace in child_traces]
+        elif node_type == OR:
+            own = [trace for child in tree.children(i).tolist() for trace in traces.pop(child)]
+        else:
+            own = []
+        for trace in own:
+            trace.insert(0, node_names[i])
+        traces[i] = own
+    return traces[node]
+
+
+def iter_traces(tree, node=0, limit=None, names=True):
+    """
+    Yield the traces of the subtree at node id node, in get_traces order.
+    tree can be a CompiledTree, a JSON dict or an AnyNode (then its subtree is used).
+    Stops after limit traces; names=False yields tuples of node ids instead of name lists.
+    """
+    tree = as_compiled(tree)
+    types, node_names = tree.types, tree.names
+    if limit is not None and limit <= 0:
+        return
+
+    path = []
+    # (type, children) per node, read from the arrays once: nodes are expanded once per trace
+    plans = {}
+    # choice points to come back to: (agenda, path length). The agenda is a linked
+    # list (node id, rest) of nodes still to expand after the current one.
+    stack = [((node, None), 0)]
+    count = 0
+    while stack:
+        agenda, length = stack.pop()
+        del path[length:]
+        while agenda is not None:
+            i, agenda = agenda
+            plan = plans.get(i)
+            if plan is None:
+                node_type = int(types[i])
+                if node_type in (SEQ, AND):
+                    kids = tree.ordered_children(i)[::-1]
+                elif node_type == OR:
+                    kids = tree.children(i).tolist()
+                else:
+                    kids = None
+                plan = plans[i] = (node_type, kids)
+            node_type, kids = plan
+            path.append(i)
+            if node_type == ACT:
+                continue
+            if node_type in (SEQ, AND):
+                for child in kids:
+                    agenda = (child, agenda)
+            elif node_type == OR:
+                if not kids:
+                    break
+                # the other children are tried after everything below the first one
+                for child in reversed(kids[1:]):
+                    stack.append(((child, agenda), len(path)))
+                agenda = (kids[0], agenda)
+            else:
+                break  # unknown node type, no traces through here
+        else:
+            yield [node_names[i] for i in path] if names else tuple(path)
+            count += 1
+            if limit is not None and count >= limit:
+                return
@@ -0,0 +1,84 @@
+'''
+Per-tree lookup index for generate_explanation.
+
+generate_explanation in assignment4.py rebuilds a name -> node map with
+PreOrderIter on every call, tests trace membership on lists and walks .parent
+chains for the D factor. TreeIndex keeps all of that for a compiled tree:
+
+- node_of: name -> node id
+- ancestors(i) / goal_chain(i): the parent chain, cached per node
+- is_ancestor(u, v): O(1) with the pre-order intervals [i, end[i]) of the tree
+- trace(names): node ids plus membership sets of a trace, cached per trace
+  (a locked LRU, so threads can share the index)
+
+Build it once per tree with tree_index(tree) and pass it to the explanation calls.
+'''
+
+from collections import OrderedDict
+import threading
+
+from goal_tree import SEQ, AND, OR, derived
+
+
+class TreeIndex:
+    """Name, ancestor and trace-membership lookups of one compiled tree."""
+
+    def __init__(self, tree, max_traces=1024):
+        self.tree = tree
+        self.node_of = tree.name_to_id
+        self.max_traces = max_traces
+        self._ancestors = {}
+        self._goal_chains = {}
+        self._traces = OrderedDict()
+        self._traces_lock = threading.Lock()  # the server's threads share one index per tree
+
+    def ancestors(self, i):
+        """Tuple of the ancestors of node i, parent first."""
+        chain = self._ancestors.get(i)
+        if chain is not None:
+            return chain
+        # climb to the first node with a known chain, then fill in on the way back
+        path = []
+        node = i
+        while node >= 0 and node not in self._ancestors:
+            path.append(node)
+            node = int(self.tree.parent[node])
+        chain = (node,) + self._ancestors[node] if node >= 0 else ()
+        for node in reversed(path):
+            self._ancestors[node] = chain
+            chain = (node,) + chain
+        return self._ancestors[i]
+
+    def is_ancestor(self, u, v):
+        """True if u is a proper ancestor of v."""
+        return u < v < self.tree.end[u]
+
+    def goal_chain(self, i):
+        """Names of the AND/SEQ/OR ancestors of node i, nearest first (the D factor)."""
+        names = self._goal_chains.get(i)
+        if names is None:
+            types = self.tree.types
+            names = tuple(self.tree.names[a] for a in self.ancestors(i) if types[a] in (AND, SEQ, OR))
+            self._goal_chains[i] = names
+        return names
+
+    def trace(self, names):
+        """(node ids, node id set, name set) of a trace given as a list of names."""
+        key = tuple(names)
+        with self._traces_lock:
+            entry = self._traces.get(key)
+            if entry is not None:
+                self._traces.move_to_end(key)
+                return entry
+        ids = [self.node_of[name] for name in key]
+        entry = (ids, set(ids), set(key))
+        with self._traces_lock:
+            self._traces[key] = entry
+            if len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+        return entry
+
+
+def tree_index(tree):
+    """Name lookup, ancestor chains and trace sets of a tree, built once per tree."""
+    return derived(tree, "tree_index", TreeIndex)
@@ -0,0 +1,290 @@
+'''
+Saliency maps scored against the bounding boxes in annotations/.
+
+"Bounding_box_annotations_(320x320).xlsx" has one row per image (Test is
+test_image.png, Rad_k is Rad_k.png) with up to two boxes as x_start, y_start,
+x_end, y_end in pixels of the 320x320 images. load_boxes() reads it once into
+a NaN-padded (images, boxes, 4) array, kept in memory and in a ".npz" file next
+to the workbook tied to its size/mtime, so openpyxl only runs after an edit.
+
+Images are decoded lazily: ImageSet.batches() decodes a batch on a thread
+pool (PIL releases the GIL while decoding) while the previous one is scored.
+The metrics take a (batch, H, W) stack of saliency maps and are vectorized
+over the batch:
+
+- pointing_game: the map's maximum falls inside a box (tolerance pixels around it)
+- iou_at_threshold: IoU of the boxes with the (positive) map thresholded at a
+  fraction of its maximum, one column per threshold
+- energy_in_box: share of the (positive) saliency mass inside the boxes
+
+Images without boxes get NaN. The benchmark uses the grey values of each image
+as a baseline saliency map and reports images per second:
+
+    python saliency_eval.py --repeat 50 --workers 4
+'''
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+try:
+    import openpyxl  # only needed when the box cache is missing or stale
+except ImportError:
+    openpyxl = None
+
+ANNOTATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "annotations")
+BOX_FILE = "Bounding_box_annotations_(320x320).xlsx"
+IMAGE_SHAPE = (320, 320)
+THRESHOLDS = (0.25, 0.5, 0.75)
+
+_boxes = {}  # workbook path -> (source info, names, boxes)
+
+
+def image_name(label):
+    """File stem of a workbook row label ('Rad_1 ' -> 'Rad_1', 'Test ' -> 'test_image')."""
+    label = str(label).strip()
+    return "test_image" if label.lower() == "test" else label
+
+
+def _source_info(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _read_workbook(path):
+    if openpyxl is None:
+        raise ImportError("reading %s needs openpyxl" % os.path.basename(path))
+    sheet = openpyxl.load_workbook(path, read_only=True, data_only=True).worksheets[0]
+    rows = [row for row in sheet.iter_rows(min_row=2, values_only=True) if row and row[0] is not None]
+    names, boxes = [], []
+    for row in rows:
+        values = list(row[1:])
+        row_boxes = [values[k:k + 4] for k in range(0, len(values) - 3, 4)]
+        names.append(image_name(row[0]))
+        boxes.append([box for box in row_boxes if all(v is not None for v in box)])
+    array = np.full((len(names), max([len(b) for b in boxes] + [1]), 4), np.nan, dtype=np.float32)
+    for k, row_boxes in enumerate(boxes):
+        if row_boxes:
+            array[k, :len(row_boxes)] = row_boxes
+    return names, array
+
+
+def load_boxes(path=None, use_cache=True):
+    """
+    (names, boxes) of the workbook: boxes[k, b] is (x_start, y_start, x_end, y_end)
+    of box b of image names[k], NaN rows pad images with fewer boxes.
+    """
+    path = path or os.path.join(ANNOTATIONS, BOX_FILE)
+    info = _source_info(path)
+    cached = _boxes.get(path)
+    if use_cache and cached is not None and cached[0] == info:
+        return cached[1], cached[2]
+    npz_path = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".npz")
+    names = boxes = None
+    if use_cache and os.path.exists(npz_path):
+        with np.load(npz_path) as data:
+            if data["source"].tolist() == info:
+                names, boxes = data["names"].tolist(), data["boxes"]
+    if names is None:
+        names, boxes = _read_workbook(path)
+        if use_cache:
+            try:
+                np.savez(npz_path, names=np.array(names), boxes=boxes, source=np.array(info, dtype=np.int64))
+            except OSError:
+                pass  # read-only location, just skip the file cache
+    _boxes[path] = (info, names, boxes)
+    return names, boxes
+
+
+def box_masks(boxes, shape=IMAGE_SHAPE, tolerance=0):
+    """(images, H, W) bool masks of the union of each image's boxes, grown by tolerance pixels."""
+    boxes = np.asarray(boxes, dtype=np.float32)
+    ys = np.arange(shape[0], dtype=np.float32)[:, None]
+    xs = np.arange(shape[1], dtype=np.float32)[None, :]
+    x0, y0, x1, y1 = (boxes[..., k, None, None] for k in range(4))
+    # NaN padding compares False, so it adds nothing
+    inside = ((xs >= x0 - tolerance) & (xs < x1 + tolerance)
+              & (ys >= y0 - tolerance) & (ys < y1 + tolerance))
+    return inside.any(axis=1)
+
+
+def _check(saliency, masks):
+    saliency = np.asarray(saliency, dtype=np.float32)
+    if saliency.ndim == 2:
+        saliency = saliency[None]
+    if saliency.shape[1:] != masks.shape[1:] or len(saliency) != len(masks):
+        raise ValueError("saliency maps %s do not match the box masks %s" % (saliency.shape, masks.shape))
+    return saliency
+
+
+def _no_box(masks, scores):
+    scores = scores.astype(np.float64)
+    scores[~masks.any(axis=(1, 2))] = np.nan
+    return scores
+
+
+def pointing_game(saliency, masks):
+    """Per map, 1.0 if its maximum (the first one) is inside the mask, NaN without a box."""
+    saliency = _check(saliency, masks)
+    flat = saliency.reshape(len(saliency), -1)
+    hits = masks.reshape(len(masks), -1)[np.arange(len(flat)), flat.argmax(axis=1)]
+    return _no_box(masks, hits)
+
+
+def iou_at_threshold(saliency, masks, thresholds=THRESHOLDS):
+    """
+    (maps, thresholds) IoU of the masks with saliency >= t * the map's maximum,
+    negative saliency counted as 0. A flat map (no positive saliency, or the
+    same value everywhere) points nowhere and gets 0.
+    """
+    saliency = np.clip(_check(saliency, masks), 0, None)
+    flat_maps = saliency.reshape(len(saliency), -1)
+    peak = flat_maps.max(axis=1)
+    in_box = np.count_nonzero(masks, axis=(1, 2))
+    scores = np.empty((len(saliency), len(thresholds)))
+    for k, t in enumerate(thresholds):
+        region = saliency >= t * peak[:, None, None]
+        both = np.count_nonzero(region & masks, axis=(1, 2))
+        union = np.count_nonzero(region, axis=(1, 2)) + in_box - both
+        scores[:, k] = both / np.maximum(union, 1)
+    # otherwise the whole image is selected and the IoU is the box area share
+    scores[(peak <= 0) | (flat_maps.min(axis=1) == peak)] = 0
+    return _no_box(masks, scores)
+
+
+def energy_in_box(saliency, masks):
+    """Per map, the share of its positive saliency inside the mask (0 for an all-zero map)."""
+    saliency = np.clip(_check(saliency, masks), 0, None)
+    total = saliency.sum(axis=(1, 2), dtype=np.float64)
+    inside = np.einsum("bhw,bhw->b", saliency, masks.astype(np.float32), dtype=np.float64)
+    return _no_box(masks, inside / np.where(total > 0, total, 1))
+
+
+def evaluate(saliency, masks, thresholds=THRESHOLDS, tolerance_masks=None):
+    """
+    All three metrics for a batch as {metric: per-map array}. tolerance_masks,
+    if given, are the grown masks used for the pointing game.
+    """
+    return {
+        "pointing_game": pointing_game(saliency, masks if tolerance_masks is None else tolerance_masks),
+        "iou": iou_at_threshold(saliency, masks, thresholds),
+        "energy_in_box": energy_in_box(saliency, masks),
+    }
+
+
+def decode_image(path):
+    """An image file as a (H, W) float32 grey array in [0, 1]."""
+    with Image.open(path) as image:
+        return np.asarray(image.convert("L"), dtype=np.float32) / 255.0
+
+
+class ImageSet:
+    """The annotated images, decoded only when a batch asks for them."""
+
+    def __init__(self, directory=ANNOTATIONS, box_file=None, tolerance=0):
+        self.directory = directory
+        self.names, self.boxes = load_boxes(os.path.join(directory, box_file or BOX_FILE))
+        self.index = {name: k for k, name in enumerate(self.names)}
+        self.masks = box_masks(self.boxes)
+        self.tolerance_masks = box_masks(self.boxes, tolerance=tolerance) if tolerance else None
+        # every image in the directory, the ones without a workbook row have no box
+        self.images = sorted(name[:-4] for name in os.listdir(directory) if name.endswith(".png"))
+
+    def __len__(self):
+        return len(self.images)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + ".png")
+
+    def image(self, name):
+        return decode_image(self.path(name))
+
+    def _masks(self, masks, chunk):
+        empty = np.zeros((1,) + masks.shape[1:], dtype=bool)
+        return np.concatenate([masks[[self.index[name]]] if name in self.index else empty for name in chunk])
+
+    def batches(self, names=None, batch_size=16, workers=4):
+        """
+        Yield (names, images, masks) per batch, images a (batch, H, W) stack. The
+        next batch is decoded on the thread pool while the caller scores this one.
+        """
+        names = list(self.images if names is None else names)
+        chunks = [names[k:k + batch_size] for k in range(0, len(names), batch_size)]
+        if not chunks:
+            return
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            pending = [pool.submit(self.image, name) for name in chunks[0]]
+            for k, chunk in enumerate(chunks):
+                images = np.stack([future.result() for future in pending])
+                if k + 1 < len(chunks):
+                    pending = [pool.submit(self.image, name) for name in chunks[k + 1]]
+                yield chunk, images, self._masks(self.masks, chunk)
+
+    def evaluate(self, saliency_of, names=None, batch_size=16, workers=4, thresholds=THRESHOLDS):
+        """
+        Score saliency_of(names, images) -> (batch, H, W) maps over the image set,
+        returns {metric: array over all images} plus "names".
+        """
+        results = {"names": []}
+        for chunk, images, masks in self.batches(names, batch_size, workers):
+            scores = evaluate(saliency_of(chunk, images), masks, thresholds,
+                              None if self.tolerance_masks is None else self._masks(self.tolerance_masks, chunk))
+            results["names"].extend(chunk)
+            for metric, values in scores.items():
+                results.setdefault(metric, []).append(values)
+        for metric in ("pointing_game", "iou", "energy_in_box"):
+            if metric in results:
+                results[metric] = np.concatenate(results[metric])
+        return results
+
+
+def summary(results, thresholds=THRESHOLDS):
+    """Means over the images with boxes."""
+    out = {"images": len(results["names"]),
+           "with_boxes": int(np.sum(~np.isnan(results["energy_in_box"])))}
+    if out["with_boxes"]:
+        out["pointing_game"] = float(np.nanmean(results["pointing_game"]))
+        out["energy_in_box"] = float(np.nanmean(results["energy_in_box"]))
+        for t, values in zip(thresholds, results["iou"].T):
+            out["iou@%g" % t] = float(np.nanmean(values))
+    return out
+
+
+def benchmark(repeat=20, batch_size=16, workers=4, tolerance=0):
+    """Images per second for decoding and scoring the image set repeat times, grey values as saliency."""
+    images = ImageSet(tolerance=tolerance)
+    names = images.images * repeat
+    started = time.perf_counter()
+    results = images.evaluate(lambda chunk, batch: batch, names, batch_size, workers)
+    seconds = time.perf_counter() - started
+    out = summary(results)
+    out.update(seconds=seconds, images_per_second=len(names) / seconds if seconds else None,
+               batch_size=batch_size, workers=workers)
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="passes over the annotated images")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4, help="image decoding threads")
+    parser.add_argument("--tolerance", type=int, default=0, help="pointing game tolerance in pixels")
+    parser.add_argument("--out", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.repeat, args.batch_size, args.workers, args.tolerance)
+    print("%d images in %.2fs, %.1f images/s (batch %d, %d decoding threads)" % (
+        results["images"], results["seconds"], results["images_per_second"], args.batch_size, args.workers))
+    print(json.dumps({k: v for k, v in results.items() if k not in ("seconds", "images_per_second")}))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()